@@ -10,6 +10,14 @@ class Settings(BaseSettings):
     BOT_TOKENS: str = ""  # Comma-separated
     STRING_SESSIONS: str = ""  # Comma-separated premium sessions
     MAIN_BOT_TOKEN: Optional[str] = None
+    USER_CLIENT_CAPACITY: int = 3  # Concurrent operations per string session
+    BOT_CLIENT_CAPACITY: int = 4  # Concurrent operations per bot token
+    CLIENT_START_TIMEOUT: float = 30.0  # Seconds one client may take to connect at startup
+    CLIENT_MIN_READY: int = 1  # Clients connected before the server starts serving
+    CLIENT_ACQUIRE_TIMEOUT: float = 30.0  # Seconds to wait for a free client before failing
+    CLIENT_RATE_LIMIT: float = 20.0  # Client checkouts per second per client (0 to disable)
+    CLIENT_RATE_BURST: float = 40.0
+    MEDIA_WARM_DCS: str = ""  # Comma-separated DC ids to open media sessions on at startup
     
     # Storage configuration
     STORAGE_CHANNEL: int
@@ -22,6 +30,12 @@ class Settings(BaseSettings):
     SUPABASE_URL: str
     SUPABASE_SERVICE_ROLE_KEY: str
     
+    # Database connection pool
+    DB_POOL_SIZE: int = 20  # Max HTTP connections to Supabase
+    DB_MAX_CONCURRENT_QUERIES: int = 20
+    DB_TIMEOUT: float = 10.0  # Seconds per query
+    DB_CONNECT_TIMEOUT: float = 5.0
+    
     # Server configuration
     PORT: int = 8000
     PING_INTERVAL: int = 300  # Auto-ping interval in seconds (0 to disable)
@@ -30,10 +44,64 @@ class Settings(BaseSettings):
     # File limits
     MAX_FILE_SIZE: int = 4 * 1024 * 1024 * 1024  # 4GB for premium
     MAX_FILE_SIZE_BOT: int = 2 * 1024 * 1024 * 1024  # 2GB for bots
+    UPLOAD_BLOCK_SIZE: int = 1024 * 1024  # Bytes buffered per disk write while receiving uploads
+    
+    # URL downloads
+    DOWNLOAD_SEGMENTS: int = 8  # Parallel byte-range requests per file
+    DOWNLOAD_MIN_SEGMENT_SIZE: int = 4 * 1024 * 1024
+    DOWNLOAD_SEGMENT_RETRIES: int = 5  # Resume attempts per segment
+    HTTP_MAX_CONNECTIONS: int = 64  # Shared pool for all URL downloads
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 8
+    DOWNLOAD_PIPELINE: bool = True  # Upload parts of big files while they are still downloading
+    
+    # Telegram upload configuration
+    UPLOAD_PARALLEL_MIN_SIZE: int = 20 * 1024 * 1024  # Files at least this big upload parts in parallel
+    UPLOAD_PART_WORKERS: int = 8  # 512KB parts in flight per file
+    UPLOAD_CONNECTIONS: int = 4  # MTProto connections the parts are spread over
+    UPLOAD_PART_RETRIES: int = 5
+    METADATA_WORKERS: int = 2  # Processes for MIME sniffing, image decoding and ffprobe
+    METADATA_TIMEOUT: float = 60.0  # Seconds before an ffprobe run is abandoned
+    THUMBNAIL_SIZE: int = 320  # Longest side of generated thumbnails in pixels (0 to disable)
+    THUMBNAIL_QUALITY: int = 70  # WebP quality
     
     # Streaming configuration
     CHUNK_SIZE: int = 1024 * 1024  # 1MB chunks
-    MAX_CONCURRENT_DOWNLOADS: int = 3
+    STREAM_PARALLEL_FETCHES: int = 4  # Chunks fetched at once per file, spread over clients
+    STREAM_READAHEAD_CHUNKS: int = 8  # Chunks buffered ahead of the client per stream
+    STREAM_READAHEAD_BUDGET: int = 16 * 1024 * 1024  # Max bytes prefetched per (IP, file) stream
+    STREAM_READAHEAD_IDLE_TTL: int = 60  # Seconds before an idle stream's prefetch is dropped
+    STREAM_READAHEAD_MAX_STREAMS: int = 256
+    CHUNK_CACHE_DIR: str = "cache/chunks"
+    CHUNK_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # 2GB on disk (0 to disable)
+    STREAM_CACHE_CONTROL: str = "public, max-age=86400"  # Bytes behind a file id never change
+    
+    # Job queue for uploads and URL imports
+    MAX_CONCURRENT_DOWNLOADS: int = 3  # Jobs transferring to/from Telegram at once
+    JOB_MAX_PER_USER: int = 2  # Jobs running at once for one user_id
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_DELAY: float = 10.0  # Seconds before the first retry, doubled after each failure
+    JOB_MAX_PER_HOST: int = 2  # URL imports fetching from the same host at once
+    IMPORT_MAX_URLS: int = 500  # URLs accepted by one bulk import request
+    
+    # Progress reporting
+    PROGRESS_TTL: int = 600  # Seconds a finished task's progress stays readable
+    PROGRESS_MAX_FINISHED: int = 1000
+    PROGRESS_MIN_INTERVAL: float = 0.5  # Min seconds between pushed byte-progress updates
+    PROGRESS_KEEPALIVE: int = 15  # Seconds between SSE keepalive comments
+    
+    # File listing
+    FILES_PAGE_SIZE: int = 100
+    FILES_MAX_PAGE_SIZE: int = 1000
+    
+    # Backup / restore
+    RESTORE_BATCH_SIZE: int = 500  # Rows inserted per database round trip
+    BACKUP_PAGE_SIZE: int = 1000  # Rows read per page when exporting
+    
+    # Metadata cache for file lookups by telegram_file_id
+    METADATA_CACHE_SIZE: int = 10000
+    METADATA_CACHE_TTL: int = 300  # Seconds
+    METADATA_NEGATIVE_CACHE_TTL: int = 15  # Seconds to remember "not found"
+    THUMBNAIL_CACHE_SIZE: int = 2000  # Thumbnails kept in memory for /api/thumb
     
     class Config:
         env_file = ".env"
@@ -47,6 +115,10 @@ class Settings(BaseSettings):
     def session_list(self) -> List[str]:
         return [session.strip() for session in self.STRING_SESSIONS.split(",") if session.strip()]
     
+    @property
+    def media_dc_list(self) -> List[int]:
+        return [int(dc.strip()) for dc in self.MEDIA_WARM_DCS.split(",") if dc.strip().isdigit()]
+    
     @property
     def admin_ids(self) -> List[int]:
         return [int(id.strip()) for id in self.TELEGRAM_ADMIN_IDS.split(",") if id.strip().isdigit()]
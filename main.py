@@ -1,6 +1,6 @@
 
-from fastapi import FastAPI, Request, HTTPException, Depends, BackgroundTasks, File, UploadFile, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import uvicorn
@@ -9,19 +9,27 @@ import os
 import logging
 from typing import Optional, List
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 import aiofiles
 import tempfile
+import uuid
+import zlib
 
 from config import get_settings
 from utils.clients import TelegramManager
 from utils.uploader import TelegramUploader
 from utils.downloader import URLDownloader
 from utils.streamer import ByteStreamer
+from utils.streamer.conditional import check_preconditions
 from utils.directoryHandler import DatabaseManager
 from utils.botmode import BotModeHandler
 from utils.logger import setup_logger
 from utils.extra import ping_server
+from utils.ingest import ingest_multipart
+from utils.backup import read_backup_rows, gzip_ndjson, GzipDecoder
+from utils.jobs import JobQueue, Job, PermanentJobError
+from utils.imports import BatchImporter
+from utils.progress import ProgressTracker
 
 app = FastAPI(title="Telegram File Manager", version="1.0.0")
 security = HTTPBearer()
@@ -40,16 +48,66 @@ app.add_middleware(
 # Initialize managers
 telegram_manager = TelegramManager()
 db_manager = DatabaseManager()
-uploader = TelegramUploader(telegram_manager, db_manager)
-downloader = URLDownloader(telegram_manager, db_manager)
-bot_handler = BotModeHandler(telegram_manager, db_manager)
+progress_tracker = ProgressTracker(
+    ttl=settings.PROGRESS_TTL,
+    max_finished=settings.PROGRESS_MAX_FINISHED,
+    min_interval=settings.PROGRESS_MIN_INTERVAL
+)
+uploader = TelegramUploader(telegram_manager, db_manager, progress_tracker)
+downloader = URLDownloader(telegram_manager, db_manager, uploader)
+bot_handler = BotModeHandler(telegram_manager, db_manager, uploader)
 streamer = ByteStreamer(telegram_manager)
+job_queue = JobQueue(
+    db_manager,
+    max_concurrent=settings.MAX_CONCURRENT_DOWNLOADS,
+    max_per_user=settings.JOB_MAX_PER_USER,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retry_delay=settings.JOB_RETRY_DELAY,
+    progress=progress_tracker,
+    max_per_host=settings.JOB_MAX_PER_HOST
+)
+importer = BatchImporter(job_queue, db_manager, progress_tracker, settings.IMPORT_MAX_URLS)
+
+async def run_upload_job(job: Job) -> dict:
+    """Send a file spooled by /api/upload to Telegram"""
+    payload = job.payload
+    if not os.path.exists(payload["path"]):
+        raise PermanentJobError("Uploaded file is no longer on disk")
+    return await uploader.upload_file(
+        payload["path"],
+        payload["filename"],
+        job.user_id,
+        payload["size"],
+        mime_type=payload.get("mime_type"),
+        delete_on_error=False,
+        task_id=job.id,
+        sha256=payload.get("sha256")
+    )
+
+def discard_upload(job: Job):
+    path = job.payload.get("path")
+    if path and os.path.exists(path):
+        os.unlink(path)
+
+async def run_url_job(job: Job) -> dict:
+    """Download a URL and upload it to Telegram"""
+    return await downloader.download_and_upload(
+        job.payload["url"],
+        job.payload.get("filename"),
+        job.user_id,
+        task_id=job.id
+    )
+
+job_queue.register("upload", run_upload_job, cleanup=discard_upload)
+job_queue.register("url", run_url_job)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize all clients and start background tasks"""
     await telegram_manager.initialize()
     await db_manager.initialize()
+    await streamer.initialize()
+    await job_queue.start()
     
     # Start bot mode if enabled
     if settings.MAIN_BOT_TOKEN:
@@ -64,7 +122,12 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
+    await job_queue.stop()
+    await streamer.close()
+    await downloader.close()
+    uploader.close()
     await telegram_manager.cleanup()
+    await db_manager.close()
     logger.info("FastAPI server shutdown complete")
 
 async def verify_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -73,6 +136,15 @@ async def verify_admin(credentials: HTTPAuthorizationCredentials = Depends(secur
         raise HTTPException(status_code=401, detail="Invalid admin password")
     return True
 
+def parse_priority(value) -> int:
+    """Job priority from a request field; higher runs sooner"""
+    if value in (None, ""):
+        return 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="priority must be an integer")
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -83,51 +155,108 @@ async def root():
     }
 
 @app.get("/api/files")
-async def list_files(user_id: Optional[str] = None):
-    """List all files from database"""
+async def list_files(
+    user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = settings.FILES_PAGE_SIZE,
+    fields: Optional[str] = None,
+    sort: str = "-uploaded_at",
+    type: Optional[str] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    uploaded_after: Optional[str] = None,
+    uploaded_before: Optional[str] = None
+):
+    """List files one page at a time (keyset pagination via `cursor`)"""
+    if limit < 1 or limit > settings.FILES_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {settings.FILES_MAX_PAGE_SIZE}"
+        )
+        
     try:
-        files = await db_manager.get_user_files(user_id)
-        return {"success": True, "files": files}
+        files, next_cursor = await db_manager.list_files(
+            user_id=user_id,
+            cursor=cursor,
+            limit=limit,
+            columns=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+            sort=sort,
+            file_type=type,
+            min_size=min_size,
+            max_size=max_size,
+            uploaded_after=uploaded_after,
+            uploaded_before=uploaded_before
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error listing files: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+        
+    async def generate():
+        # Encode row by row instead of building the whole body at once
+        yield '{"success": true, "files": ['
+        for i, row in enumerate(files):
+            yield ("," if i else "") + json.dumps(row, default=str)
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+        
+    return StreamingResponse(generate(), media_type="application/json")
 
 @app.post("/api/upload")
 async def upload_file(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    user_id: str = Form(...),
+    request: Request,
     admin: bool = Depends(verify_admin)
 ):
-    """Upload file to Telegram"""
+    """Upload file to Telegram.
+    
+    Expects multipart/form-data with a `file` part and a `user_id` field. The
+    body is copied to disk in fixed-size blocks, hashed and MIME-sniffed in
+    the same pass, so memory use does not grow with the file size.
+    """
     try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        # Start upload in background
-        background_tasks.add_task(
-            uploader.upload_file,
-            tmp_path,
-            file.filename,
-            user_id,
-            file.size
+        file_info, fields = await ingest_multipart(
+            request.headers.get("content-type", ""),
+            request.stream(),
+            max_size=settings.MAX_FILE_SIZE,
+            block_size=settings.UPLOAD_BLOCK_SIZE
         )
-        
-        return {
-            "success": True,
-            "message": f"Upload started for {file.filename}",
-            "file_size": file.size
-        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Upload error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+        
+    user_id = fields.get("user_id")
+    if not user_id:
+        os.unlink(file_info["path"])
+        raise HTTPException(status_code=400, detail="user_id required")
+        
+    # Queue the upload to Telegram
+    job = await job_queue.submit(
+        "upload",
+        {
+            "path": file_info["path"],
+            "filename": file_info["filename"],
+            "size": file_info["size"],
+            "mime_type": file_info["mime_type"],
+            "sha256": file_info["sha256"]
+        },
+        user_id=user_id,
+        priority=parse_priority(fields.get("priority"))
+    )
+    
+    return {
+        "success": True,
+        "message": f"Upload queued for {file_info['filename']}",
+        "job_id": job.id,
+        "task_id": job.id,
+        "file_size": file_info["size"],
+        "mime_type": file_info["mime_type"],
+        "sha256": file_info["sha256"]
+    }
 
 @app.post("/api/download-url")
 async def download_from_url(
-    background_tasks: BackgroundTasks,
     request: Request,
     admin: bool = Depends(verify_admin)
 ):
@@ -141,68 +270,148 @@ async def download_from_url(
         if not url or not user_id:
             raise HTTPException(status_code=400, detail="URL and user_id required")
         
-        # Start download in background
-        background_tasks.add_task(
-            downloader.download_and_upload,
-            url,
-            filename,
-            user_id
+        # Queue the download
+        job = await job_queue.submit(
+            "url",
+            {"url": url, "filename": filename},
+            user_id=user_id,
+            priority=parse_priority(data.get("priority"))
         )
         
         return {
             "success": True,
-            "message": "Download started",
+            "message": "Download queued",
+            "job_id": job.id,
+            "task_id": job.id,
             "url": url
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"URL download error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/stream/{file_id}")
+@app.post("/api/download-url/batch")
+async def download_from_urls(
+    request: Request,
+    admin: bool = Depends(verify_admin)
+):
+    """Import a list of URLs to Telegram as one batch"""
+    try:
+        data = await request.json()
+        urls = data.get("urls")
+        user_id = data.get("user_id")
+        
+        if not isinstance(urls, list) or not urls or not user_id:
+            raise HTTPException(status_code=400, detail="urls (a non-empty list) and user_id required")
+        
+        batch = await importer.submit(urls, user_id, priority=parse_priority(data.get("priority")))
+        return {
+            "success": True,
+            "message": f"Queued {batch['queued']} downloads",
+            **batch
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch URL import error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/imports/{batch_id}")
+async def get_import(batch_id: str, admin: bool = Depends(verify_admin)):
+    """Get aggregate progress and per-URL status of a bulk import"""
+    batch = await importer.status(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return {"success": True, "import": batch}
+
+@app.delete("/api/imports/{batch_id}")
+async def cancel_import(batch_id: str, admin: bool = Depends(verify_admin)):
+    """Cancel the unfinished downloads of a bulk import"""
+    cancelled = await importer.cancel(batch_id)
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return {"success": True, "cancelled": cancelled}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, admin: bool = Depends(verify_admin)):
+    """Get the status of an upload or URL import job"""
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"success": True, "job": job}
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str, admin: bool = Depends(verify_admin)):
+    """Cancel a queued or running job"""
+    if not await job_queue.cancel(job_id):
+        raise HTTPException(status_code=404, detail="No active job with that id")
+    return {"success": True, "message": "Job cancelled"}
+
+@app.api_route("/api/stream/{file_id}", methods=["GET", "HEAD"])
 async def stream_file(file_id: str, request: Request):
-    """Stream file with byte-range support"""
+    """Stream file with byte-range support and HTTP cache validators"""
     try:
         # Get file info from database
         file_info = await db_manager.get_file_by_telegram_id(file_id)
         if not file_info:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Handle range requests
-        range_header = request.headers.get("range")
+        return await streamer.respond(
+            file_id,
+            file_info,
+            request.headers,
+            method=request.method,
+            client_ip=request.client.host if request.client else None
+        )
         
-        if range_header:
-            # Parse range header
-            range_start, range_end = streamer.parse_range_header(
-                range_header, 
-                file_info.get("file_size", 0)
-            )
-            
-            # Stream partial content
-            return await streamer.stream_partial(
-                file_id,
-                range_start,
-                range_end,
-                file_info
-            )
-        else:
-            # Stream full file
-            return await streamer.stream_full(file_id, file_info)
-            
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Streaming error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/download/{file_id}")
-async def download_file(file_id: str):
-    """Download file as attachment"""
+@app.get("/api/thumb/{file_id}")
+async def get_thumbnail(file_id: str, request: Request):
+    """Serve the thumbnail made at upload time. Thumbnails never change, so
+    browsers may cache them for good and revalidate with If-None-Match."""
+    thumbnail = await db_manager.get_thumbnail(file_id)
+    if not thumbnail:
+        raise HTTPException(status_code=404, detail="No thumbnail for this file")
+    
+    etag = f'"{thumbnail["etag"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    status = check_preconditions(request.headers, etag, None, request.method)
+    if status is not None:
+        return Response(status_code=status, headers=headers)
+    
+    return Response(content=thumbnail["data"], media_type=thumbnail["mime_type"], headers=headers)
+
+@app.api_route("/api/download/{file_id}", methods=["GET", "HEAD"])
+async def download_file(file_id: str, request: Request):
+    """Download file as attachment (resumable with Range requests)"""
     try:
         file_info = await db_manager.get_file_by_telegram_id(file_id)
         if not file_info:
             raise HTTPException(status_code=404, detail="File not found")
         
         # Stream file as download
-        return await streamer.stream_download(file_id, file_info)
+        return await streamer.respond(
+            file_id,
+            file_info,
+            request.headers,
+            method=request.method,
+            client_ip=request.client.host if request.client else None,
+            attachment=True
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Download error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -229,6 +438,13 @@ async def get_stats(admin: bool = Depends(verify_admin)):
             "success": True,
             "stats": stats,
             "clients_connected": len(telegram_manager.clients),
+            "client_pool": telegram_manager.pool.stats(),
+            "media_sessions": telegram_manager.media_session_stats(),
+            "chunk_cache": streamer.cache.stats(),
+            "readahead": streamer.readahead.stats(),
+            "metadata_cache": db_manager.file_cache.stats(),
+            "thumbnail_cache": db_manager.thumbnail_cache.stats(),
+            "jobs": job_queue.stats(),
             "uptime": datetime.now().isoformat()
         }
     except Exception as e:
@@ -249,28 +465,117 @@ async def backup_database(admin: bool = Depends(verify_admin)):
         logger.error(f"Backup error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/backup/export")
+async def export_backup(since: Optional[str] = None, admin: bool = Depends(verify_admin)):
+    """Stream the catalog as gzip-compressed NDJSON.
+    
+    Pass the X-Backup-Timestamp of a previous export as `since` for an
+    incremental backup.
+    """
+    if since:
+        try:
+            datetime.fromisoformat(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="since must be an ISO 8601 timestamp")
+            
+    now = datetime.now(timezone.utc)
+    # "Z" rather than "+00:00", which turns into a space in an unencoded query string
+    started_at = now.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    filename = f"backup-{now.strftime('%Y%m%dT%H%M%SZ')}.ndjson.gz"
+    
+    return StreamingResponse(
+        gzip_ndjson(db_manager.iter_files(since=since, page_size=settings.BACKUP_PAGE_SIZE)),
+        media_type="application/gzip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Backup-Timestamp": started_at
+        }
+    )
+
 @app.post("/api/restore")
 async def restore_database(
     request: Request,
+    background_tasks: BackgroundTasks,
     admin: bool = Depends(verify_admin)
 ):
-    """Restore database from JSON backup"""
+    """Restore database from a backup.
+    
+    NDJSON bodies (one file row per line, optionally gzipped as produced by
+    /api/backup/export) are spooled to disk and restored in batches in the
+    background; poll /api/progress/{task_id}. A JSON body of the
+    form {"backup": {"files": [...]}} is still accepted for small backups.
+    """
+    content_type = request.headers.get("content-type", "")
+    gzipped = (
+        "gzip" in content_type
+        or request.headers.get("content-encoding", "").lower() == "gzip"
+    )
+    
     try:
+        if gzipped or "ndjson" in content_type or "jsonl" in content_type:
+            decoder = GzipDecoder() if gzipped else None
+            with tempfile.NamedTemporaryFile(delete=False, suffix="_restore.ndjson") as tmp:
+                tmp_path = tmp.name
+            try:
+                async with aiofiles.open(tmp_path, "wb") as out:
+                    async for chunk in request.stream():
+                        await out.write(decoder.feed(chunk) if decoder else chunk)
+                    if decoder:
+                        await out.write(decoder.flush())
+            except (zlib.error, EOFError):
+                os.unlink(tmp_path)
+                raise HTTPException(status_code=400, detail="Invalid gzip body")
+            except BaseException:
+                # run_restore only removes the spool file once it owns it
+                os.unlink(tmp_path)
+                raise
+                    
+            task_id = f"restore_{uuid.uuid4().hex}"
+            progress_tracker.start(task_id, "queued")
+            background_tasks.add_task(run_restore, tmp_path, task_id)
+            
+            return {
+                "success": True,
+                "message": "Restore started",
+                "task_id": task_id
+            }
+            
         data = await request.json()
         backup_data = data.get("backup")
         
         if not backup_data:
             raise HTTPException(status_code=400, detail="Backup data required")
-        
+            
         success = await db_manager.restore_from_json(backup_data)
         return {
             "success": success,
             "message": "Database restored successfully" if success else "Restore failed"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Restore error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def run_restore(path: str, task_id: str):
+    """Restore a spooled NDJSON backup, reporting batch progress under task_id"""
+    def report(summary: dict):
+        progress_tracker.set_status(task_id, "restoring", **summary)
+        
+    try:
+        summary = await db_manager.restore_rows(
+            read_backup_rows(path),
+            batch_size=settings.RESTORE_BATCH_SIZE,
+            progress_callback=report
+        )
+        progress_tracker.set_status(task_id, "completed", **summary)
+    except Exception as e:
+        logger.error(f"Restore error: {e}")
+        progress_tracker.set_status(task_id, "failed", error=str(e))
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
 @app.get("/api/progress/{task_id}")
 async def get_progress(task_id: str):
     """Get upload/download progress"""
@@ -281,6 +586,26 @@ async def get_progress(task_id: str):
         logger.error(f"Progress error: {e}")
         return {"success": False, "progress": 0}
 
+@app.get("/api/progress/{task_id}/events")
+async def progress_events(task_id: str):
+    """Server-sent events with a task's progress (status, percent, speed in
+    bytes/s, ETA in seconds) until it completes, fails or is cancelled"""
+    if progress_tracker.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+        
+    async def generate():
+        async for state in progress_tracker.subscribe(task_id, keepalive=settings.PROGRESS_KEEPALIVE):
+            if state is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {json.dumps(state, default=str)}\n\n"
+                
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
@@ -0,0 +1,9 @@
+-- Indexes backing keyset pagination in GET /api/files (ORDER BY <column>, id)
+create index if not exists telegram_files_uploaded_at_id_idx
+    on public.telegram_files (uploaded_at desc, id desc);
+
+create index if not exists telegram_files_user_uploaded_at_id_idx
+    on public.telegram_files (user_id, uploaded_at desc, id desc);
+
+create index if not exists telegram_files_file_name_id_idx
+    on public.telegram_files (file_name, id);
@@ -0,0 +1,58 @@
+-- Storage statistics maintained incrementally, so /api/stats reads a handful
+-- of counter rows instead of scanning telegram_files.
+create table if not exists public.telegram_file_stats (
+    user_id text not null,
+    file_type text not null,
+    file_count bigint not null default 0,
+    total_size bigint not null default 0,
+    primary key (user_id, file_type)
+);
+
+create or replace function public.telegram_file_stats_add(
+    p_user_id text,
+    p_file_type text,
+    p_count bigint,
+    p_size bigint
+) returns void
+language sql
+as $$
+    insert into public.telegram_file_stats as s (user_id, file_type, file_count, total_size)
+    values (p_user_id, coalesce(p_file_type, 'application/octet-stream'), p_count, p_size)
+    on conflict (user_id, file_type) do update
+        set file_count = s.file_count + excluded.file_count,
+            total_size = s.total_size + excluded.total_size;
+$$;
+
+create or replace function public.telegram_files_stats_trigger() returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.telegram_file_stats_add(
+            old.user_id::text, old.file_type, -1, -coalesce(old.file_size, 0)
+        );
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform public.telegram_file_stats_add(
+            new.user_id::text, new.file_type, 1, coalesce(new.file_size, 0)
+        );
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists telegram_files_stats on public.telegram_files;
+create trigger telegram_files_stats
+    after insert or delete or update of user_id, file_type, file_size
+    on public.telegram_files
+    for each row execute function public.telegram_files_stats_trigger();
+
+-- Backfill from the existing catalog
+truncate public.telegram_file_stats;
+insert into public.telegram_file_stats (user_id, file_type, file_count, total_size)
+select user_id::text,
+       coalesce(file_type, 'application/octet-stream'),
+       count(*),
+       coalesce(sum(file_size), 0)
+from public.telegram_files
+group by 1, 2;
@@ -0,0 +1,19 @@
+-- Persistent queue for uploads and URL imports, so jobs that were queued or
+-- running when the server stopped are picked up again on the next start.
+create table if not exists public.telegram_jobs (
+    id text primary key,
+    kind text not null,
+    user_id text,
+    payload jsonb not null default '{}'::jsonb,
+    priority integer not null default 0,
+    status text not null default 'queued',
+    attempts integer not null default 0,
+    error text,
+    result jsonb,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists telegram_jobs_pending_idx
+    on public.telegram_jobs (created_at)
+    where status in ('queued', 'retrying', 'running');
@@ -0,0 +1,4 @@
+-- Look up the jobs of a bulk URL import by the batch id in their payload.
+create index if not exists telegram_jobs_batch_idx
+    on public.telegram_jobs ((payload->>'batch_id'))
+    where payload ? 'batch_id';
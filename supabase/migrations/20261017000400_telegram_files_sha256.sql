@@ -0,0 +1,7 @@
+-- Content hash of each file, so uploading bytes that are already stored
+-- reuses the existing Telegram message instead of sending them again.
+alter table public.telegram_files add column if not exists sha256 text;
+
+create index if not exists telegram_files_sha256_idx
+    on public.telegram_files (sha256)
+    where sha256 is not null;
@@ -0,0 +1,3 @@
+-- Properties read by ffprobe at upload time: duration, width, height,
+-- bitrate, container and codecs.
+alter table public.telegram_files add column if not exists media_info jsonb;
@@ -0,0 +1,11 @@
+-- Small WebP thumbnails made at upload time, one per Telegram file and
+-- shared by every catalog row pointing at it. Kept out of telegram_files
+-- so listings don't carry the image bytes.
+create table if not exists public.telegram_thumbnails (
+    telegram_file_id text primary key,
+    mime_type text not null,
+    width integer not null,
+    height integer not null,
+    data bytea not null,
+    created_at timestamptz not null default now()
+);
@@ -0,0 +1,32 @@
+-- Storage totals aggregated in the database and returned as one JSON value,
+-- so /api/stats stays correct however many (user, type) counter rows exist
+-- and whatever row cap PostgREST applies.
+create or replace function public.telegram_file_stats_summary() returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'total_files', coalesce(sum(s.file_count), 0),
+        'total_size', coalesce(sum(s.total_size), 0),
+        'by_user', coalesce((
+            select json_object_agg(u.user_id, json_build_object('total_files', u.files, 'total_size', u.size))
+            from (
+                select user_id, sum(file_count) as files, sum(total_size) as size
+                from public.telegram_file_stats
+                where file_count > 0
+                group by user_id
+            ) u
+        ), '{}'::json),
+        'by_type', coalesce((
+            select json_object_agg(t.file_type, json_build_object('total_files', t.files, 'total_size', t.size))
+            from (
+                select file_type, sum(file_count) as files, sum(total_size) as size
+                from public.telegram_file_stats
+                where file_count > 0
+                group by file_type
+            ) t
+        ), '{}'::json)
+    )
+    from public.telegram_file_stats s
+    where s.file_count > 0;
+$$;
@@ -0,0 +1,10 @@
+-- GET /api/files pages with NULL sort values last in both directions
+-- (ORDER BY <column> ... NULLS LAST, id). Rebuild the descending indexes to
+-- match; ascending indexes already put NULLs last.
+drop index if exists public.telegram_files_uploaded_at_id_idx;
+create index if not exists telegram_files_uploaded_at_nl_id_idx
+    on public.telegram_files (uploaded_at desc nulls last, id desc);
+
+drop index if exists public.telegram_files_user_uploaded_at_id_idx;
+create index if not exists telegram_files_user_uploaded_at_nl_id_idx
+    on public.telegram_files (user_id, uploaded_at desc nulls last, id desc);
@@ -0,0 +1,49 @@
+import json
+import logging
+import zlib
+from typing import AsyncGenerator, AsyncIterator
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+async def read_backup_rows(path: str) -> AsyncGenerator[dict, None]:
+    """Yield file rows from an NDJSON backup one line at a time"""
+    async with aiofiles.open(path, "r", encoding="utf-8") as f:
+        line_number = 0
+        async for line in f:
+            line_number += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping malformed backup line {line_number}: {e}")
+                continue
+            if isinstance(row, dict):
+                yield row
+
+async def gzip_ndjson(rows: AsyncIterator[dict], level: int = 6) -> AsyncGenerator[bytes, None]:
+    """Encode rows as gzip-compressed NDJSON, yielding compressed blocks as they fill"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for row in rows:
+        block = compressor.compress((json.dumps(row, default=str) + "\n").encode())
+        if block:
+            yield block
+    yield compressor.flush()
+
+class GzipDecoder:
+    """Incrementally gunzip a request body, e.g. a backup made by gzip_ndjson"""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        data = self._decompressor.flush()
+        if not self._decompressor.eof:
+            raise EOFError("Compressed body ended before the end of the gzip stream")
+        return data
@@ -6,6 +6,7 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 import tempfile
 import os
+from datetime import datetime
 
 from .clients import TelegramManager
 from .directoryHandler import DatabaseManager
@@ -15,12 +16,17 @@ from config import get_settings
 logger = logging.getLogger(__name__)
 
 class BotModeHandler:
-    def __init__(self, telegram_manager: TelegramManager, db_manager: DatabaseManager):
+    def __init__(
+        self,
+        telegram_manager: TelegramManager,
+        db_manager: DatabaseManager,
+        uploader: Optional[TelegramUploader] = None
+    ):
         self.telegram_manager = telegram_manager
         self.db_manager = db_manager
         self.settings = get_settings()
         self.bot_client: Optional[Client] = None
-        self.uploader = TelegramUploader(telegram_manager, db_manager)
+        self.uploader = uploader or TelegramUploader(telegram_manager, db_manager)
         
     async def start_bot(self):
         """Start bot mode for file uploads"""
@@ -132,10 +138,22 @@ class BotModeHandler:
                     return
                     
                 stats = await self.db_manager.get_stats()
+                top_types = sorted(
+                    stats.get('by_type', {}).items(),
+                    key=lambda item: item[1]['total_size'],
+                    reverse=True
+                )[:5]
+                type_lines = "".join(
+                    f"  • {mime}: {entry['total_files']} files, "
+                    f"{round(entry['total_size'] / (1024 * 1024), 2)} MB\n"
+                    for mime, entry in top_types
+                )
                 await message.reply(
                     f"📊 **Storage Statistics**\n\n"
                     f"📁 Total Files: {stats['total_files']}\n"
                     f"💾 Total Size: {stats['total_size_mb']} MB\n"
+                    f"👤 Users: {len(stats.get('by_user', {}))}\n"
+                    + (f"🗂 Top Types:\n{type_lines}" if type_lines else "") +
                     f"🕒 Updated: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
                 )
                 
@@ -1,61 +1,344 @@
 
 import asyncio
 import logging
-from typing import Dict, List, Optional
-from pyrogram import Client
-from pyrogram.errors import FloodWait, AuthKeyUnregistered
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Set
+from pyrogram import Client, raw
+from pyrogram.errors import AuthBytesInvalid
+from pyrogram.file_id import FileId
+from pyrogram.session import Auth, Session
 from config import get_settings
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=4096)
+def _decode_dc(telegram_file_id: str) -> int:
+    return FileId.decode(telegram_file_id).dc_id
+
+class NoClientAvailable(Exception):
+    """No client slot became free before the acquire timeout"""
+
+class TokenBucket:
+    """Allow `rate` requests per second on average with bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is now)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def spend(self):
+        self._refill()
+        self.tokens -= 1
+
+class ClientPool:
+    """Hands out Telegram clients by free capacity slots.
+
+    Each client contributes `capacity` slots to the user or bot group. A
+    free slot is taken from the front of its group's queue and returned to
+    the back, so load rotates across clients. When every slot is taken,
+    callers wait in FIFO order and a released slot goes straight to the
+    first waiter.
+
+    Clients cooling down after a FloodWait, or out of request budget, are
+    skipped; a caller only waits on them when no other client is free.
+    """
+
+    def __init__(self, rate: float = 0, burst: float = 1):
+        self.clients: Dict[str, Client] = {}
+        self.capacity: Dict[str, int] = {}
+        self.in_use: Dict[str, int] = {}
+        self.rate = rate
+        self.burst = burst
+        self._names: Dict[int, str] = {}  # id(client) -> name
+        self._free: Dict[str, Deque[str]] = {"user": deque(), "bot": deque()}
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._cooldown_until: Dict[str, float] = {}  # monotonic time
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def add(self, name: str, client: Client, capacity: int):
+        capacity = max(1, capacity)
+        self.clients[name] = client
+        self.capacity[name] = capacity
+        self.in_use[name] = 0
+        self._names[id(client)] = name
+        if self.rate > 0:
+            self._buckets[name] = TokenBucket(self.rate, self.burst)
+        for _ in range(capacity):
+            self._release_slot(name)
+        self._interleave(self._group(name))
+
+    async def acquire(
+        self,
+        prefer_user: bool = True,
+        timeout: Optional[float] = None,
+        dc_id: Optional[int] = None
+    ) -> Client:
+        """Take a slot, waiting up to `timeout` seconds for one to free up.
+        prefer_user=False takes from whichever group has more free slots.
+        With `dc_id`, clients holding a media session on that DC go first."""
+        if not self.clients:
+            raise NoClientAvailable("No Telegram clients available")
+
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        while True:
+            name = self._take_slot(prefer_user, dc_id)
+            if name is not None:
+                break
+
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise NoClientAvailable(f"No Telegram client free within {timeout}s")
+            # Wake up when a slot is released or a throttled client recovers
+            recovery = self._recovery_time()
+            if recovery is None or (remaining is not None and remaining < recovery):
+                wait = remaining
+            else:
+                wait = recovery
+
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                name = await asyncio.wait_for(asyncio.shield(waiter), wait)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled():
+                    # A slot was handed over just as we gave up, pass it on
+                    self._release_slot(waiter.result())
+                else:
+                    waiter.cancel()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                continue
+
+            if self._available(name):
+                break
+            # Handed a throttled client's slot; park it and keep waiting
+            self._free[self._group(name)].append(name)
+
+        self.in_use[name] += 1
+        bucket = self._buckets.get(name)
+        if bucket:
+            bucket.spend()
+        return self.clients[name]
+
+    def release(self, client: Client):
+        name = self._names.get(id(client))
+        if name is None:
+            return
+        if self.in_use[name] <= 0:
+            logger.warning(f"Client {name} released more often than acquired")
+            return
+        self.in_use[name] -= 1
+        self._release_slot(name)
+
+    def cool_down(self, client: Client, seconds: float):
+        """Keep new work off a client until a FloodWait of `seconds` has passed"""
+        name = self._names.get(id(client))
+        if name is None:
+            return
+        until = time.monotonic() + seconds
+        if until > self._cooldown_until.get(name, 0):
+            self._cooldown_until[name] = until
+            logger.warning(f"Client {name} cooling down for {seconds}s after FloodWait")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "clients": {
+                name: {
+                    "in_use": self.in_use[name],
+                    "capacity": self.capacity[name],
+                    "cooldown": round(max(0.0, self._cooldown_until.get(name, 0) - now), 1),
+                    "tokens": round(self._buckets[name].tokens, 1) if name in self._buckets else None
+                }
+                for name in self.clients
+            },
+            "free_slots": sum(len(slots) for slots in self._free.values()),
+            "waiting": sum(1 for waiter in self._waiters if not waiter.done())
+        }
+
+    def _available(self, name: str) -> bool:
+        return self._throttled_for(name) <= 0
+
+    def _throttled_for(self, name: str) -> float:
+        """Seconds until the client may take new work"""
+        wait = self._cooldown_until.get(name, 0) - time.monotonic()
+        bucket = self._buckets.get(name)
+        if bucket:
+            wait = max(wait, bucket.wait_time())
+        return wait
+
+    def _recovery_time(self) -> Optional[float]:
+        """Seconds until a free but throttled slot becomes usable, if any"""
+        waits = [self._throttled_for(name) for slots in self._free.values() for name in set(slots)]
+        return max(0.0, min(waits)) if waits else None
+
+    def _take_slot(self, prefer_user: bool, dc_id: Optional[int] = None) -> Optional[str]:
+        users, bots = self._free["user"], self._free["bot"]
+        if prefer_user:
+            order = (users, bots)
+        else:
+            order = (users, bots) if len(users) > len(bots) else (bots, users)
+
+        if dc_id is not None:
+            for slots in order:
+                name = self._pop_slot(slots, lambda n: dc_id in self.clients[n].media_sessions)
+                if name is not None:
+                    return name
+
+        for slots in order:
+            name = self._pop_slot(slots)
+            if name is not None:
+                return name
+        return None
+
+    def _pop_slot(self, slots: Deque[str], accept: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        # Rotate past throttled (or unwanted) clients; usually the first slot is usable
+        for _ in range(len(slots)):
+            name = slots.popleft()
+            if self._available(name) and (accept is None or accept(name)):
+                return name
+            slots.append(name)
+        return None
+
+    def _interleave(self, group: str):
+        """Order free slots round-robin by client so concurrent requests spread out"""
+        free: Dict[str, int] = {}
+        for name in self._free[group]:
+            free[name] = free.get(name, 0) + 1
+        slots = self._free[group]
+        slots.clear()
+        while free:
+            for name in list(free):
+                slots.append(name)
+                free[name] -= 1
+                if not free[name]:
+                    del free[name]
+
+    def _group(self, name: str) -> str:
+        return "user" if name.startswith("user_") else "bot"
+
+    def _release_slot(self, name: str):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(name)
+                return
+        self._free[self._group(name)].append(name)
+
 class TelegramManager:
     def __init__(self):
         self.settings = get_settings()
         self.clients: Dict[str, Client] = {}
         self.active_client: Optional[Client] = None
-        self.client_usage = {}
+        self._startup_tasks: List[asyncio.Task] = []
+        # DC -> chunk requests seen for files stored there. Every client keeps
+        # a warm media session on each of these DCs.
+        self.dc_requests: Dict[int, int] = {dc_id: 0 for dc_id in self.settings.media_dc_list}
+        self._warmups: Set[asyncio.Task] = set()
+        self.pool = ClientPool(
+            rate=self.settings.CLIENT_RATE_LIMIT,
+            burst=self.settings.CLIENT_RATE_BURST
+        )
         
     async def initialize(self):
-        """Initialize all Telegram clients"""
-        await self._create_bot_clients()
-        await self._create_user_clients()
+        """Start all Telegram clients concurrently and return once
+        CLIENT_MIN_READY of them are connected; the rest keep connecting
+        in the background and join the pool as they come up."""
+        self._startup_tasks = [
+            asyncio.create_task(self._start_client(name, client, capacity))
+            for name, client, capacity in self._create_bot_clients() + self._create_user_clients()
+        ]
+        min_ready = min(max(1, self.settings.CLIENT_MIN_READY), len(self._startup_tasks))
+        
+        ready = 0
+        for started in asyncio.as_completed(self._startup_tasks):
+            if await started:
+                ready += 1
+                if ready >= min_ready:
+                    break
+                    
         await self._select_best_client()
         
-    async def _create_bot_clients(self):
+        connecting = sum(1 for task in self._startup_tasks if not task.done())
+        if connecting:
+            logger.info(f"{ready} Telegram clients ready, {connecting} still connecting in the background")
+            
+    def _create_bot_clients(self) -> List[tuple]:
         """Create bot clients from tokens"""
-        for i, token in enumerate(self.settings.bot_token_list):
-            try:
-                client = Client(
+        return [
+            (
+                f"bot_{i}",
+                Client(
                     f"bot_{i}",
                     api_id=self.settings.API_ID,
                     api_hash=self.settings.API_HASH,
                     bot_token=token,
                     workdir="sessions"
-                )
-                await client.start()
-                self.clients[f"bot_{i}"] = client
-                self.client_usage[f"bot_{i}"] = 0
-                logger.info(f"Bot client {i} connected successfully")
-            except Exception as e:
-                logger.error(f"Failed to connect bot {i}: {e}")
+                ),
+                self.settings.BOT_CLIENT_CAPACITY
+            )
+            for i, token in enumerate(self.settings.bot_token_list)
+        ]
                 
-    async def _create_user_clients(self):
+    def _create_user_clients(self) -> List[tuple]:
         """Create user clients from string sessions"""
-        for i, session in enumerate(self.settings.session_list):
-            try:
-                client = Client(
+        return [
+            (
+                f"user_{i}",
+                Client(
                     f"user_{i}",
                     api_id=self.settings.API_ID,
                     api_hash=self.settings.API_HASH,
                     session_string=session
-                )
-                await client.start()
-                self.clients[f"user_{i}"] = client
-                self.client_usage[f"user_{i}"] = 0
-                logger.info(f"User client {i} connected successfully")
-            except Exception as e:
-                logger.error(f"Failed to connect user {i}: {e}")
-                
+                ),
+                self.settings.USER_CLIENT_CAPACITY
+            )
+            for i, session in enumerate(self.settings.session_list)
+        ]
+        
+    async def _start_client(self, name: str, client: Client, capacity: int) -> bool:
+        """Connect one client within CLIENT_START_TIMEOUT and add it to the pool"""
+        try:
+            await asyncio.wait_for(client.start(), self.settings.CLIENT_START_TIMEOUT)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                logger.error(f"Client {name} did not connect within {self.settings.CLIENT_START_TIMEOUT}s")
+            else:
+                logger.error(f"Failed to connect {name}: {e}")
+            if client.is_connected:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+            return False
+            
+        self.clients[name] = client
+        self.pool.add(name, client, capacity)
+        logger.info(f"Client {name} connected successfully")
+        if self.dc_requests:
+            self._warm(client, list(self.dc_requests))
+        
+        # A user client that connects late still takes over from a fallback bot
+        if self.active_client is not None and name.startswith("user_") and self.active_client.name.startswith("bot_"):
+            await self._select_best_client()
+        return True
+        
     async def _select_best_client(self):
         """Select the best client for operations"""
         if not self.clients:
@@ -72,33 +355,130 @@ class TelegramManager:
         self.active_client = next(iter(self.clients.values()))
         logger.info("Selected bot client as fallback")
         
-    async def get_client(self, prefer_user: bool = True) -> Client:
-        """Get the best available client"""
-        if prefer_user:
-            # Try to get user client first
-            for name, client in self.clients.items():
-                if name.startswith("user_") and self.client_usage[name] < 3:
-                    self.client_usage[name] += 1
-                    return client
-                    
-        # Fallback to least used client
-        min_usage = min(self.client_usage.values())
-        for name, client in self.clients.items():
-            if self.client_usage[name] == min_usage:
-                self.client_usage[name] += 1
-                return client
-                
-        return self.active_client
+    async def get_client(
+        self,
+        prefer_user: bool = True,
+        timeout: Optional[float] = None,
+        dc_id: Optional[int] = None
+    ) -> Client:
+        """Get a client with a free slot, waiting for one if all are busy.
+        Must be paired with release_client(); prefer use_client()."""
+        return await self.pool.acquire(
+            prefer_user,
+            self.settings.CLIENT_ACQUIRE_TIMEOUT if timeout is None else timeout,
+            dc_id
+        )
         
     async def release_client(self, client: Client):
         """Release client back to pool"""
-        for name, c in self.clients.items():
-            if c == client:
-                self.client_usage[name] = max(0, self.client_usage[name] - 1)
-                break
+        self.pool.release(client)
+        
+    def report_flood_wait(self, client: Client, seconds: float):
+        """Route new work away from `client` until its FloodWait has passed"""
+        self.pool.cool_down(client, seconds)
+        
+    @asynccontextmanager
+    async def use_client(
+        self,
+        prefer_user: bool = True,
+        timeout: Optional[float] = None,
+        dc_id: Optional[int] = None
+    ) -> AsyncIterator[Client]:
+        """`async with manager.use_client() as client:` releases the slot however the block exits"""
+        client = await self.get_client(prefer_user, timeout, dc_id)
+        try:
+            yield client
+        finally:
+            self.pool.release(client)
+            
+    def file_dc(self, telegram_file_id: str) -> Optional[int]:
+        """DC a stored file lives on, read from its file id. The first file
+        seen on a new DC opens a media session there on every client."""
+        try:
+            dc_id = _decode_dc(telegram_file_id)
+        except Exception:
+            return None
+            
+        if dc_id not in self.dc_requests:
+            self.dc_requests[dc_id] = 0
+            for client in list(self.clients.values()):
+                self._warm(client, [dc_id])
+        self.dc_requests[dc_id] += 1
+        return dc_id
+        
+    async def get_media_session(self, client: Client, dc_id: int) -> Session:
+        """Reuse one media session per client and DC instead of one per request"""
+        async with client.media_sessions_lock:
+            session = client.media_sessions.get(dc_id)
+            if session is not None:
+                return session
+                
+            test_mode = await client.storage.test_mode()
+            
+            if dc_id != await client.storage.dc_id():
+                session = Session(
+                    client, dc_id,
+                    await Auth(client, dc_id, test_mode).create(),
+                    test_mode,
+                    is_media=True
+                )
+                await session.start()
+                
+                for _ in range(3):
+                    exported_auth = await client.invoke(
+                        raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+                    )
+                    try:
+                        await session.invoke(
+                            raw.functions.auth.ImportAuthorization(
+                                id=exported_auth.id,
+                                bytes=exported_auth.bytes
+                            )
+                        )
+                        break
+                    except AuthBytesInvalid:
+                        continue
+                else:
+                    await session.stop()
+                    raise AuthBytesInvalid
+            else:
+                session = Session(
+                    client, dc_id,
+                    await client.storage.auth_key(),
+                    test_mode,
+                    is_media=True
+                )
+                await session.start()
+                
+            client.media_sessions[dc_id] = session
+            logger.info(f"Media session for DC {dc_id} opened on {client.name}")
+            return session
+            
+    def media_session_stats(self) -> dict:
+        return {
+            "dc_requests": dict(self.dc_requests),
+            "clients": {name: sorted(client.media_sessions) for name, client in self.clients.items()}
+        }
+        
+    def _warm(self, client: Client, dc_ids: List[int]):
+        """Open media sessions on `dc_ids` in the background"""
+        task = asyncio.create_task(self._warm_media_sessions(client, dc_ids))
+        self._warmups.add(task)
+        task.add_done_callback(self._warmups.discard)
+        
+    async def _warm_media_sessions(self, client: Client, dc_ids: List[int]):
+        for dc_id in dc_ids:
+            try:
+                await self.get_media_session(client, dc_id)
+            except Exception as e:
+                logger.warning(f"Could not open media session for DC {dc_id} on {client.name}: {e}")
                 
     async def cleanup(self):
         """Cleanup all clients"""
+        for task in [*self._startup_tasks, *self._warmups]:
+            task.cancel()
+        await asyncio.gather(*self._startup_tasks, *self._warmups, return_exceptions=True)
+        
         for client in self.clients.values():
             try:
                 await client.stop()
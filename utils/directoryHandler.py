@@ -1,36 +1,130 @@
 
 import asyncio
+import base64
+import hashlib
 import json
 import logging
-from typing import List, Dict, Optional
+from typing import AsyncGenerator, AsyncIterator, Callable, List, Dict, Optional, Tuple
 from datetime import datetime
-from supabase import create_client, Client
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
 
 from config import get_settings
+from .cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """Async PostgREST client with a bounded, keep-alive HTTP connection pool"""
+    
+    def __init__(self, base_url: str, *, limits: httpx.Limits, **kwargs):
+        self.limits = limits
+        super().__init__(base_url, **kwargs)
+        
+    def create_session(self, base_url, headers, timeout) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=self.limits
+        )
+
+# Marks a cached "file not found" so it can be told apart from a cache miss
+_NOT_FOUND = object()
+
+# Columns clients may request from /api/files and the keys it can sort on
+FILE_COLUMNS = {
+    'id', 'user_id', 'file_name', 'file_size', 'file_type',
+    'telegram_file_id', 'telegram_message_id', 'channel_id', 'uploaded_at', 'sha256',
+    'media_info'
+}
+SORT_COLUMNS = {'uploaded_at', 'file_name'}
+
+def encode_cursor(sort: str, row: dict) -> str:
+    """Opaque keyset cursor pointing just after `row`"""
+    column = sort.lstrip('-')
+    payload = json.dumps([sort, row.get(column), row.get('id')])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """Return (sort value, id) from a cursor made by encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match sort order")
+    return value, row_id
+
+def _quote(value) -> str:
+    """Quote a value for use inside a PostgREST or=() filter"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _timestamp(name: str, value: str) -> str:
+    """An ISO 8601 query parameter, normalized, or ValueError if it isn't one"""
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 timestamp") from None
+
 class DatabaseManager:
     def __init__(self):
         self.settings = get_settings()
-        self.supabase: Optional[Client] = None
+        self.postgrest: Optional[PooledPostgrestClient] = None
+        self._query_slots = asyncio.Semaphore(self.settings.DB_MAX_CONCURRENT_QUERIES)
+        # telegram_file_id -> file row, so chained range requests skip the database
+        self.file_cache = TTLCache(
+            self.settings.METADATA_CACHE_SIZE,
+            self.settings.METADATA_CACHE_TTL
+        )
+        # telegram_file_id -> thumbnail; thumbnails never change, so keep them a day
+        self.thumbnail_cache = TTLCache(self.settings.THUMBNAIL_CACHE_SIZE, 24 * 3600)
         
     async def initialize(self):
-        """Initialize Supabase client"""
+        """Initialize the async Supabase (PostgREST) client"""
         try:
-            self.supabase = create_client(
-                self.settings.SUPABASE_URL,
-                self.settings.SUPABASE_SERVICE_ROLE_KEY
+            key = self.settings.SUPABASE_SERVICE_ROLE_KEY
+            self.postgrest = PooledPostgrestClient(
+                f"{self.settings.SUPABASE_URL.rstrip('/')}/rest/v1",
+                headers={
+                    **DEFAULT_POSTGREST_CLIENT_HEADERS,
+                    "apikey": key,
+                    "Authorization": f"Bearer {key}"
+                },
+                timeout=httpx.Timeout(
+                    self.settings.DB_TIMEOUT,
+                    connect=self.settings.DB_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=self.settings.DB_POOL_SIZE,
+                    max_keepalive_connections=self.settings.DB_POOL_SIZE
+                )
             )
             logger.info("Supabase client initialized")
         except Exception as e:
             logger.error(f"Failed to initialize Supabase: {e}")
             raise e
             
+    async def close(self):
+        """Close pooled database connections"""
+        if self.postgrest:
+            await self.postgrest.aclose()
+            
+    def _table(self):
+        return self.postgrest.table('telegram_files')
+        
+    async def _execute(self, query):
+        """Run a query without blocking the event loop, bounded by DB_MAX_CONCURRENT_QUERIES"""
+        async with self._query_slots:
+            return await query.execute()
+            
     async def save_file(self, file_data: dict) -> bool:
         """Save file metadata to database"""
         try:
-            result = self.supabase.table('telegram_files').insert(file_data).execute()
+            result = await self._execute(self._table().insert(file_data))
+            self.file_cache.invalidate(file_data.get('telegram_file_id'))
             return len(result.data) > 0
         except Exception as e:
             logger.error(f"Database save error: {e}")
@@ -39,62 +133,225 @@ class DatabaseManager:
     async def get_user_files(self, user_id: Optional[str] = None) -> List[dict]:
         """Get files for a user or all files"""
         try:
-            query = self.supabase.table('telegram_files').select('*')
+            query = self._table().select('*')
             
             if user_id:
                 query = query.eq('user_id', user_id)
                 
-            result = query.order('uploaded_at', desc=True).execute()
+            result = await self._execute(query.order('uploaded_at', desc=True))
             return result.data
         except Exception as e:
             logger.error(f"Database query error: {e}")
             return []
             
+    async def list_files(
+        self,
+        user_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        columns: Optional[List[str]] = None,
+        sort: str = '-uploaded_at',
+        file_type: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        uploaded_after: Optional[str] = None,
+        uploaded_before: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Get one page of files ordered by (sort column, id), plus the next page cursor.
+        Raises ValueError for unknown columns, sort keys, cursors or malformed timestamps."""
+        column = sort.lstrip('-')
+        descending = sort.startswith('-')
+        if column not in SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort: {sort}")
+            
+        if columns:
+            unknown = set(columns) - FILE_COLUMNS
+            if unknown:
+                raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+            # The cursor needs the sort column and id of the last row
+            selected = list(dict.fromkeys([*columns, column, 'id']))
+        else:
+            selected = ['*']
+            
+        query = self._table().select(*selected)
+        
+        if user_id:
+            query = query.eq('user_id', user_id)
+        if file_type:
+            if '/' in file_type and not file_type.endswith('/'):
+                query = query.eq('file_type', file_type)
+            else:
+                query = query.like('file_type', f"{file_type.rstrip('/')}/*")
+        if min_size is not None:
+            query = query.gte('file_size', min_size)
+        if max_size is not None:
+            query = query.lte('file_size', max_size)
+        if uploaded_after:
+            query = query.gte('uploaded_at', _timestamp('uploaded_after', uploaded_after))
+        if uploaded_before:
+            query = query.lt('uploaded_at', _timestamp('uploaded_before', uploaded_before))
+            
+        if cursor:
+            value, row_id = decode_cursor(cursor, sort)
+            op = 'lt' if descending else 'gt'
+            # postgrest-py 0.13 has no or_() helper, so add the keyset condition
+            # directly. NULLs sort last in both directions, so they follow every value.
+            if value is None:
+                query.params = query.params.add(
+                    'and',
+                    f"({column}.is.null,id.{op}.{_quote(row_id)})"
+                )
+            else:
+                query.params = query.params.add(
+                    'or',
+                    f"({column}.{op}.{_quote(value)},"
+                    f"and({column}.eq.{_quote(value)},id.{op}.{_quote(row_id)}),"
+                    f"{column}.is.null)"
+                )
+            
+        direction = 'desc' if descending else 'asc'
+        query.params = query.params.add('order', f"{column}.{direction}.nullslast,id.{direction}")
+        
+        # Fetch one extra row to know whether another page exists
+        result = await self._execute(query.limit(limit + 1))
+        rows = result.data
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(sort, rows[-1])
+            
+        if columns:
+            rows = [{key: row.get(key) for key in columns} for row in rows]
+        return rows, next_cursor
+        
     async def get_file_by_telegram_id(self, telegram_file_id: str) -> Optional[dict]:
         """Get file by Telegram file ID"""
+        cached = self.file_cache.get(telegram_file_id)
+        if cached is not None:
+            return None if cached is _NOT_FOUND else dict(cached)
+            
+        # Deduplicated uploads share a Telegram file id, so always pick the
+        # original row; otherwise the name and Last-Modified could change
+        # from one request to the next.
+        query = self._table().select('*').eq('telegram_file_id', telegram_file_id)
+        query.params = query.params.add('order', 'uploaded_at.asc.nullslast,id.asc')
         try:
-            result = self.supabase.table('telegram_files').select('*').eq(
-                'telegram_file_id', telegram_file_id
-            ).single().execute()
-            return result.data
+            result = await self._execute(query.limit(1))
         except Exception as e:
             logger.error(f"File lookup error: {e}")
             return None
             
+        if not result.data:
+            self.file_cache.set(
+                telegram_file_id,
+                _NOT_FOUND,
+                ttl=self.settings.METADATA_NEGATIVE_CACHE_TTL
+            )
+            return None
+            
+        self.file_cache.set(telegram_file_id, result.data[0])
+        return dict(result.data[0])
+            
+    async def get_file_by_hash(self, sha256: str, file_size: int) -> Optional[dict]:
+        """Get a stored file with the same content, if any"""
+        try:
+            result = await self._execute(
+                self._table()
+                .select('*')
+                .eq('sha256', sha256)
+                .eq('file_size', file_size)
+                .neq('telegram_file_id', '')
+                .limit(1)
+            )
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"Hash lookup error: {e}")
+            return None
+            
+    async def save_thumbnail(self, telegram_file_id: str, thumbnail: dict) -> bool:
+        """Store the thumbnail (data, mime_type, width, height) of a Telegram file"""
+        try:
+            await self._execute(
+                self.postgrest.table('telegram_thumbnails').upsert(
+                    {
+                        'telegram_file_id': telegram_file_id,
+                        'mime_type': thumbnail['mime_type'],
+                        'width': thumbnail['width'],
+                        'height': thumbnail['height'],
+                        # bytea in PostgREST's hex input format
+                        'data': '\\x' + thumbnail['data'].hex()
+                    },
+                    on_conflict='telegram_file_id'
+                )
+            )
+            self.thumbnail_cache.invalidate(telegram_file_id)
+            return True
+        except Exception as e:
+            logger.error(f"Thumbnail save error: {e}")
+            return False
+            
+    async def get_thumbnail(self, telegram_file_id: str) -> Optional[dict]:
+        """Get the thumbnail of a Telegram file, with `data` as bytes and
+        an `etag` derived from them"""
+        cached = self.thumbnail_cache.get(telegram_file_id)
+        if cached is not None:
+            return None if cached is _NOT_FOUND else cached
+            
+        try:
+            result = await self._execute(
+                self.postgrest.table('telegram_thumbnails')
+                .select('mime_type', 'width', 'height', 'data')
+                .eq('telegram_file_id', telegram_file_id)
+                .limit(1)
+            )
+        except Exception as e:
+            logger.error(f"Thumbnail lookup error: {e}")
+            return None
+            
+        if not result.data:
+            self.thumbnail_cache.set(
+                telegram_file_id,
+                _NOT_FOUND,
+                ttl=self.settings.METADATA_NEGATIVE_CACHE_TTL
+            )
+            return None
+            
+        row = result.data[0]
+        data = bytes.fromhex(row['data'][2:])
+        thumbnail = {**row, 'data': data, 'etag': hashlib.sha256(data).hexdigest()[:32]}
+        self.thumbnail_cache.set(telegram_file_id, thumbnail)
+        return thumbnail
+            
     async def delete_file(self, file_id: str) -> bool:
         """Delete file from database"""
         try:
-            result = self.supabase.table('telegram_files').delete().eq(
-                'id', file_id
-            ).execute()
+            result = await self._execute(self._table().delete().eq('id', file_id))
+            for row in result.data:
+                self.file_cache.invalidate(row.get('telegram_file_id'))
             return len(result.data) > 0
         except Exception as e:
             logger.error(f"Database delete error: {e}")
             return False
             
     async def get_stats(self) -> dict:
-        """Get database statistics"""
+        """Get database statistics, summed in the database from the
+        trigger-maintained telegram_file_stats counters"""
         try:
-            # Count files
-            files_result = self.supabase.table('telegram_files').select(
-                'id', count='exact'
-            ).execute()
-            
-            # Get total size
-            size_result = self.supabase.table('telegram_files').select(
-                'file_size'
-            ).execute()
-            
-            total_size = sum(row.get('file_size', 0) for row in size_result.data)
+            result = await self._execute(self.postgrest.rpc('telegram_file_stats_summary', {}))
+            summary = result.data or {}
+            total_size = int(summary.get('total_size') or 0)
             
             return {
-                "total_files": len(files_result.data),
+                "total_files": int(summary.get('total_files') or 0),
                 "total_size": total_size,
-                "total_size_mb": round(total_size / (1024 * 1024), 2)
+                "total_size_mb": round(total_size / (1024 * 1024), 2),
+                "by_user": summary.get('by_user') or {},
+                "by_type": summary.get('by_type') or {}
             }
         except Exception as e:
             logger.error(f"Stats error: {e}")
-            return {"total_files": 0, "total_size": 0, "total_size_mb": 0}
+            return {"total_files": 0, "total_size": 0, "total_size_mb": 0, "by_user": {}, "by_type": {}}
             
     async def backup_to_json(self) -> dict:
         """Backup database to JSON"""
@@ -108,18 +365,172 @@ class DatabaseManager:
             logger.error(f"Backup error: {e}")
             return {}
             
+    async def iter_files(
+        self,
+        since: Optional[str] = None,
+        page_size: int = 1000
+    ) -> AsyncGenerator[dict, None]:
+        """Yield every file row, oldest first, one keyset page at a time.
+        `since` limits it to rows uploaded at or after that timestamp."""
+        cursor = None
+        while True:
+            rows, cursor = await self.list_files(
+                cursor=cursor,
+                limit=page_size,
+                sort='uploaded_at',
+                uploaded_after=since
+            )
+            for row in rows:
+                yield row
+            if not cursor:
+                return
+                
     async def restore_from_json(self, backup_data: dict) -> bool:
         """Restore database from JSON backup"""
+        async def rows():
+            for file_data in backup_data.get("files", []):
+                yield file_data
+                
+        summary = await self.restore_rows(rows())
+        return summary["failed"] == 0
+        
+    async def restore_rows(
+        self,
+        rows: AsyncIterator[dict],
+        batch_size: int = 500,
+        progress_callback: Optional[Callable[[dict], None]] = None
+    ) -> dict:
+        """Insert backup rows in batches, skipping rows whose (telegram_file_id,
+        user_id, file_name) is already in the catalog so the same backup can be
+        restored twice. Rows sharing a telegram_file_id (deduplicated
+        uploads) are kept apart."""
+        summary = {"processed": 0, "inserted": 0, "skipped": 0, "failed": 0}
+        batch: List[dict] = []
+        
+        async for file_data in rows:
+            batch.append(file_data)
+            if len(batch) >= batch_size:
+                await self._restore_batch(batch, summary)
+                batch = []
+                if progress_callback:
+                    progress_callback(dict(summary))
+                    
+        if batch:
+            await self._restore_batch(batch, summary)
+            
+        if progress_callback:
+            progress_callback(dict(summary))
+        logger.info(f"Restore finished: {summary}")
+        return summary
+        
+    async def _restore_batch(self, batch: List[dict], summary: dict):
+        summary["processed"] += len(batch)
+        
+        pending: Dict[tuple, dict] = {}
+        for file_data in batch:
+            key = self._restore_key(file_data)
+            if not key[0] or key in pending:
+                summary["skipped"] += 1
+                continue
+            # Let the database generate new ids
+            pending[key] = {k: v for k, v in file_data.items() if k != 'id'}
+            
+        if not pending:
+            return
+            
         try:
-            files = backup_data.get("files", [])
+            # Look existing rows up in slices to keep the query string short
+            ids = list({key[0] for key in pending})
+            for i in range(0, len(ids), 100):
+                existing = await self._execute(
+                    self._table()
+                    .select('telegram_file_id', 'user_id', 'file_name')
+                    .in_('telegram_file_id', ids[i:i + 100])
+                )
+                for row in existing.data:
+                    if pending.pop(self._restore_key(row), None) is not None:
+                        summary["skipped"] += 1
+        except Exception as e:
+            logger.error(f"Restore batch lookup error: {e}")
+            summary["failed"] += len(pending)
+            return
+            
+        # PostgREST bulk inserts need every object to have the same keys
+        groups: Dict[tuple, List[dict]] = {}
+        for file_data in pending.values():
+            groups.setdefault(tuple(sorted(file_data)), []).append(file_data)
             
-            for file_data in files:
-                # Remove id to let database generate new ones
-                if 'id' in file_data:
-                    del file_data['id']
-                await self.save_file(file_data)
+        for group in groups.values():
+            try:
+                await self._execute(self._table().insert(group))
+                summary["inserted"] += len(group)
+                for file_data in group:
+                    self.file_cache.invalidate(file_data['telegram_file_id'])
+            except Exception as e:
+                logger.error(f"Restore batch insert error: {e}")
+                summary["failed"] += len(group)
                 
+    @staticmethod
+    def _restore_key(file_data: dict) -> tuple:
+        """What makes a catalog row the same row again when restoring"""
+        return (file_data.get('telegram_file_id'), file_data.get('user_id'), file_data.get('file_name'))
+        
+    async def save_job(self, job_data: dict) -> bool:
+        """Insert or update a job in the persistent job queue"""
+        try:
+            await self._execute(
+                self.postgrest.table('telegram_jobs').upsert(job_data, on_conflict='id')
+            )
             return True
         except Exception as e:
-            logger.error(f"Restore error: {e}")
+            logger.error(f"Job save error: {e}")
             return False
+            
+    async def save_jobs(self, jobs: List[dict]) -> bool:
+        """Insert or update several jobs in one request"""
+        try:
+            await self._execute(
+                self.postgrest.table('telegram_jobs').upsert(jobs, on_conflict='id')
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Jobs save error: {e}")
+            return False
+            
+    async def get_pending_jobs(self) -> List[dict]:
+        """Get jobs that were queued, waiting to retry or running, oldest first"""
+        try:
+            result = await self._execute(
+                self.postgrest.table('telegram_jobs')
+                .select('*')
+                .in_('status', ['queued', 'retrying', 'running'])
+                .order('created_at')
+            )
+            return result.data
+        except Exception as e:
+            logger.error(f"Pending jobs query error: {e}")
+            return []
+            
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        """Get a job by id"""
+        try:
+            result = await self._execute(
+                self.postgrest.table('telegram_jobs').select('*').eq('id', job_id).limit(1)
+            )
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"Job lookup error: {e}")
+            return None
+            
+    async def get_batch_jobs(self, batch_id: str) -> List[dict]:
+        """Get the jobs of a bulk URL import"""
+        try:
+            result = await self._execute(
+                self.postgrest.table('telegram_jobs')
+                .select('*')
+                .eq('payload->>batch_id', batch_id)
+            )
+            return result.data
+        except Exception as e:
+            logger.error(f"Batch jobs query error: {e}")
+            return []
@@ -3,34 +3,88 @@ import asyncio
 import aiohttp
 import tempfile
 import logging
-from typing import Optional
+import time
+from typing import Callable, Optional
 from urllib.parse import urlparse
 import os
 
 from .clients import TelegramManager
 from .directoryHandler import DatabaseManager
 from .uploader import TelegramUploader
+from .http_download import SegmentedDownloader, DownloadError
+from .part_uploader import PartAssembler
+from .extra import sanitize_filename
 
 logger = logging.getLogger(__name__)
 
 class URLDownloader:
-    def __init__(self, telegram_manager: TelegramManager, db_manager: DatabaseManager):
+    def __init__(
+        self,
+        telegram_manager: TelegramManager,
+        db_manager: DatabaseManager,
+        uploader: Optional[TelegramUploader] = None
+    ):
         self.telegram_manager = telegram_manager
         self.db_manager = db_manager
-        self.uploader = TelegramUploader(telegram_manager, db_manager)
+        self.uploader = uploader or TelegramUploader(telegram_manager, db_manager)
+        settings = telegram_manager.settings
+        self.http = SegmentedDownloader(
+            segments=settings.DOWNLOAD_SEGMENTS,
+            min_segment_size=settings.DOWNLOAD_MIN_SEGMENT_SIZE,
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_connections_per_host=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+            retries=settings.DOWNLOAD_SEGMENT_RETRIES
+        )
+        self.pipeline = settings.DOWNLOAD_PIPELINE
         
-    async def download_and_upload(self, url: str, filename: Optional[str], user_id: str) -> dict:
-        """Download file from URL and upload to Telegram"""
+    async def close(self):
+        """Close the shared HTTP connection pool"""
+        await self.http.close()
+        
+    async def download_and_upload(
+        self,
+        url: str,
+        filename: Optional[str],
+        user_id: str,
+        task_id: Optional[str] = None
+    ) -> dict:
+        """Download file from URL and upload to Telegram, reporting progress
+        of both phases under `task_id` if given.
+        
+        Big files with a known size are pipelined: each 512KB part goes to
+        Telegram as soon as it is downloaded instead of after the whole file.
+        """
         try:
-            # Download file
-            file_path, actual_filename, file_size = await self._download_file(url, filename)
-            
+            progress = self.uploader.progress
+            if task_id:
+                progress.set_status(task_id, "downloading", url=url)
+                
+            async with self.http.probe(url) as response:
+                if response.status not in (200, 206):
+                    raise Exception(f"Failed to download: HTTP {response.status}")
+                    
+                # Determine filename
+                if not filename:
+                    filename = self._extract_filename(url, response.headers)
+                    
+                file_size = self.http.content_size(response)
+                if self.pipeline and file_size and file_size >= self.uploader.parallel_min_size:
+                    return await self._transfer_pipelined(response, filename, user_id, file_size, task_id)
+                    
+                # Download file
+                file_path, file_size = await self._download_file(
+                    response,
+                    filename,
+                    (lambda current, total: progress.update(task_id, current, total)) if task_id else None
+                )
+                
             # Upload to Telegram
             result = await self.uploader.upload_file(
                 file_path,
-                actual_filename,
+                filename,
                 user_id,
-                file_size
+                file_size,
+                task_id=task_id
             )
             
             return result
@@ -39,32 +93,80 @@ class URLDownloader:
             logger.error(f"Download and upload error: {e}")
             raise e
             
-    async def _download_file(self, url: str, filename: Optional[str]) -> tuple:
-        """Download file from URL"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to download: HTTP {response.status}")
-                
-                # Determine filename
-                if not filename:
-                    filename = self._extract_filename(url, response.headers)
-                
-                # Get file size
-                file_size = int(response.headers.get('content-length', 0))
-                
-                # Check size limits
-                max_size = self.telegram_manager.settings.MAX_FILE_SIZE
-                if file_size > max_size:
-                    raise Exception(f"File too large: {file_size} > {max_size}")
+    async def _download_file(
+        self,
+        response: aiohttp.ClientResponse,
+        filename: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> tuple:
+        """Download the file behind a probe response, in parallel segments when
+        the server supports ranges. Returns (temp path, size)."""
+        path = self._temp_path(filename)
+        try:
+            file_size = await self.http.download(
+                response,
+                path,
+                self.telegram_manager.settings.MAX_FILE_SIZE,
+                progress_callback
+            )
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path, file_size
+        
+    async def _transfer_pipelined(
+        self,
+        response: aiohttp.ClientResponse,
+        filename: str,
+        user_id: str,
+        file_size: int,
+        task_id: Optional[str]
+    ) -> dict:
+        """Upload parts to Telegram while the rest of the file downloads.
+        The file on disk is the buffer; only parts being sent are in memory."""
+        path = self._temp_path(filename)
+        assembler = PartAssembler(path, file_size)
+        
+        async def download():
+            try:
+                size = await self.http.download(
+                    response,
+                    path,
+                    self.telegram_manager.settings.MAX_FILE_SIZE,
+                    on_data=assembler.written
+                )
+                if size != file_size:
+                    raise DownloadError(f"Expected {file_size} bytes, received {size}")
+            except Exception as e:
+                assembler.fail(e)
+                raise
+            except BaseException:
+                assembler.fail(DownloadError("Download cancelled"))
+                raise
                 
-                # Download to temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{filename}") as tmp:
-                    async for chunk in response.content.iter_chunked(8192):
-                        tmp.write(chunk)
-                    
-                    return tmp.name, filename, file_size
-                    
+        download_task = asyncio.create_task(download())
+        try:
+            result = await self.uploader.upload_from_parts(
+                assembler.parts(),
+                path,
+                filename,
+                user_id,
+                file_size,
+                task_id=task_id
+            )
+            await download_task
+            return result
+        except BaseException:
+            download_task.cancel()
+            await asyncio.gather(download_task, return_exceptions=True)
+            if os.path.exists(path):
+                os.unlink(path)
+            raise
+            
+    def _temp_path(self, filename: str) -> str:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{sanitize_filename(filename)}") as tmp:
+            return tmp.name
+            
     def _extract_filename(self, url: str, headers: dict) -> str:
         """Extract filename from URL or headers"""
         # Try Content-Disposition header
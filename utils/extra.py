@@ -2,6 +2,7 @@
 import asyncio
 import aiohttp
 import logging
+import os
 from config import get_settings
 
 logger = logging.getLogger(__name__)
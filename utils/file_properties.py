@@ -0,0 +1,182 @@
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _ffprobe(file_path: str, timeout: float) -> dict:
+    """Duration, dimensions, codecs and bitrate from one ffprobe call"""
+    result = subprocess.run(
+        [
+            'ffprobe',
+            '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_format',
+            '-show_streams',
+            file_path
+        ],
+        capture_output=True,
+        timeout=timeout
+    )
+    if result.returncode != 0:
+        return {}
+
+    probe = json.loads(result.stdout or b'{}')
+    fmt = probe.get('format', {})
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    duration = _number(fmt.get('duration')) or _number((video or audio or {}).get('duration'))
+    bitrate = _number(fmt.get('bit_rate'))
+    info = {
+        'duration': int(duration) if duration else 0,
+        'bitrate': int(bitrate) if bitrate else None,
+        'container': fmt.get('format_name')
+    }
+    if video:
+        info.update(
+            width=video.get('width'),
+            height=video.get('height'),
+            video_codec=video.get('codec_name')
+        )
+    if audio:
+        info['audio_codec'] = audio.get('codec_name')
+    return info
+
+def _encode_thumbnail(image, size: int, quality: int) -> dict:
+    from PIL import ImageOps
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    out = io.BytesIO()
+    image.save(out, 'WEBP', quality=quality, method=4)
+    return {'data': out.getvalue(), 'mime_type': 'image/webp', 'width': image.width, 'height': image.height}
+
+def _video_frame(file_path: str, duration: int, size: int, timeout: float) -> Optional[bytes]:
+    """A poster frame a tenth of the way in, as JPEG bytes"""
+    result = subprocess.run(
+        [
+            'ffmpeg',
+            '-v', 'quiet',
+            '-ss', str(duration / 10 if duration else 0),
+            '-i', file_path,
+            '-frames:v', '1',
+            '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+            '-f', 'image2pipe',
+            '-vcodec', 'mjpeg',
+            '-'
+        ],
+        capture_output=True,
+        timeout=timeout
+    )
+    return result.stdout if result.returncode == 0 and result.stdout else None
+
+def _make_thumbnail(file_path: str, info: dict, size: int, quality: int, timeout: float) -> Optional[dict]:
+    from PIL import Image
+    mime_type = info['mime_type']
+    if mime_type.startswith('image/'):
+        with Image.open(file_path) as img:
+            # Lets JPEG decode at a reduced scale instead of full size
+            img.draft('RGB', (size, size))
+            return _encode_thumbnail(img, size, quality)
+    if mime_type.startswith('video/') and info.get('video_codec'):
+        frame = _video_frame(file_path, info.get('duration') or 0, size, timeout)
+        if frame:
+            with Image.open(io.BytesIO(frame)) as img:
+                return _encode_thumbnail(img, size, quality)
+    return None
+
+def extract_metadata(
+    file_path: str,
+    mime_type: Optional[str],
+    timeout: float,
+    thumbnail_size: int = 0,
+    thumbnail_quality: int = 70
+) -> dict:
+    """Sniff the MIME type (unless known), read media properties and, if
+    `thumbnail_size` is set, render a WebP thumbnail of images and videos.
+    Blocking; runs in a MediaProber worker process."""
+    if not mime_type:
+        import magic
+        mime_type = magic.from_file(file_path, mime=True)
+
+    info = {'mime_type': mime_type}
+    if mime_type.startswith('image/'):
+        try:
+            from PIL import Image
+            with Image.open(file_path) as img:
+                info['width'] = img.width
+                info['height'] = img.height
+        except Exception:
+            pass
+    elif mime_type.startswith(('video/', 'audio/')):
+        try:
+            info.update(_ffprobe(file_path, timeout))
+        except Exception as e:
+            logger.error(f"ffprobe failed for {file_path}: {e}")
+
+    if thumbnail_size:
+        try:
+            thumbnail = _make_thumbnail(file_path, info, thumbnail_size, thumbnail_quality, timeout)
+            if thumbnail:
+                info['thumbnail'] = thumbnail
+        except Exception as e:
+            logger.error(f"Thumbnail failed for {file_path}: {e}")
+    return info
+
+class MediaProber:
+    """Run extract_metadata() in a small process pool, so MIME sniffing,
+    image decoding, ffprobe and thumbnailing never block the event loop"""
+
+    def __init__(self, workers: int, timeout: float, thumbnail_size: int = 0, thumbnail_quality: int = 70):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_quality = thumbnail_quality
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def probe(self, file_path: str, mime_type: Optional[str] = None) -> dict:
+        """Return mime_type plus whatever of width, height, duration,
+        bitrate, container, video_codec, audio_codec and thumbnail
+        (data, mime_type, width, height) applies"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                extract_metadata,
+                file_path,
+                mime_type,
+                self.timeout,
+                self.thumbnail_size,
+                self.thumbnail_quality
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool next time
+            logger.error(f"Metadata worker crashed on {file_path}")
+            self._executor = None
+        except Exception as e:
+            logger.error(f"Metadata extraction failed for {file_path}: {e}")
+        return {'mime_type': mime_type or 'application/octet-stream'}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import math
+import os
+import re
+from typing import Callable, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+WRITE_BLOCK_SIZE = 1024 * 1024  # Bytes buffered per segment before each disk write
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+class DownloadError(Exception):
+    """The remote file could not be downloaded"""
+
+class _SegmentInterrupted(Exception):
+    """A segment stopped early for a reason worth retrying"""
+
+class Segment:
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end  # inclusive
+        self.written = 0
+        self.attempts = 0
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start + 1
+
+    @property
+    def done(self) -> bool:
+        return self.written >= self.size
+
+class SegmentedDownloader:
+    """Download URLs over a shared connection pool, in parallel byte-range
+    segments when the server supports Range requests.
+
+    Each segment writes at its own offset of a preallocated file and, after
+    a network error, resumes from the last byte it wrote.
+    """
+
+    def __init__(
+        self,
+        segments: int,
+        min_segment_size: int,
+        max_connections: int,
+        max_connections_per_host: int,
+        retries: int,
+        read_timeout: float = 60
+    ):
+        self.segments = max(1, segments)
+        self.min_segment_size = max(1, min_segment_size)
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.retries = max(1, retries)
+        self.read_timeout = read_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        """The shared client session, created on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    limit_per_host=self.max_connections_per_host
+                ),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=self.read_timeout)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def download(
+        self,
+        response: aiohttp.ClientResponse,
+        path: str,
+        max_size: int,
+        progress: Optional[Callable[[int, int], None]] = None,
+        on_data: Optional[Callable[[int, int], None]] = None
+    ) -> int:
+        """Save the body of `response` to `path` and return its size.
+
+        `response` should answer a GET sent with `Range: bytes=0-0`
+        (see probe()). A 206 means the server takes ranges, so the file is
+        fetched in segments; otherwise `response` is read sequentially.
+        `on_data(offset, length)` is called whenever bytes reach the disk.
+        """
+        if response.status == 206:
+            size = self._total_size(response)
+            response.release()
+            if size is None:
+                # Ranges work but the total is unknown, read it in one go
+                async with self.session().get(response.url) as full:
+                    if full.status != 200:
+                        raise DownloadError(f"Failed to download: HTTP {full.status}")
+                    return await self._download_sequential(full, path, max_size, progress, on_data)
+
+            if size > max_size:
+                raise DownloadError(f"File too large: {size} > {max_size}")
+            await self._download_segments(
+                str(response.url),
+                path,
+                size,
+                response.headers.get("ETag") or response.headers.get("Last-Modified"),
+                progress,
+                on_data
+            )
+            return size
+
+        if response.status != 200:
+            raise DownloadError(f"Failed to download: HTTP {response.status}")
+        return await self._download_sequential(response, path, max_size, progress, on_data)
+
+    @staticmethod
+    def content_size(response: aiohttp.ClientResponse) -> Optional[int]:
+        """Full size of the file behind a probe() response, if the server says.
+        None for a compressed response: aiohttp decodes the body, so the
+        headers don't give the size of the bytes we end up with."""
+        if response.headers.get("Content-Encoding", "identity").lower() != "identity":
+            return None
+        if response.status == 206:
+            return SegmentedDownloader._total_size(response)
+        length = response.headers.get("Content-Length")
+        return int(length) if response.status == 200 and length and length.isdigit() else None
+
+    def probe(self, url: str):
+        """GET the first byte, to learn the size and whether ranges work.
+        Use as `async with downloader.probe(url) as response:`."""
+        return self.session().get(url, headers={"Range": "bytes=0-0"})
+
+    async def _download_sequential(
+        self,
+        response: aiohttp.ClientResponse,
+        path: str,
+        max_size: int,
+        progress: Optional[Callable[[int, int], None]],
+        on_data: Optional[Callable[[int, int], None]] = None
+    ) -> int:
+        total = self.content_size(response) or 0
+        if total > max_size:
+            raise DownloadError(f"File too large: {total} > {max_size}")
+
+        downloaded = 0
+        flushed = 0
+        buffer = bytearray()
+        with open(path, "wb") as f:
+            async def flush():
+                nonlocal flushed
+                await asyncio.to_thread(f.write, bytes(buffer))
+                f.flush()
+                if on_data:
+                    on_data(flushed, len(buffer))
+                flushed += len(buffer)
+                buffer.clear()
+
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                downloaded += len(chunk)
+                if downloaded > max_size:
+                    raise DownloadError(f"File too large: more than {max_size} bytes")
+                buffer += chunk
+                if len(buffer) >= WRITE_BLOCK_SIZE:
+                    await flush()
+                if progress:
+                    progress(downloaded, total or downloaded)
+            if buffer:
+                await flush()
+        return downloaded
+
+    async def _download_segments(
+        self,
+        url: str,
+        path: str,
+        size: int,
+        validator: Optional[str],
+        progress: Optional[Callable[[int, int], None]],
+        on_data: Optional[Callable[[int, int], None]] = None
+    ):
+        count = max(1, min(self.segments, math.ceil(size / self.min_segment_size)))
+        segment_size = max(1, math.ceil(size / count))
+        segments = [
+            Segment(start, min(start + segment_size, size) - 1)
+            for start in range(0, size, segment_size)
+        ]
+
+        # Preallocate so every segment can write at its own offset
+        with open(path, "wb") as f:
+            f.truncate(size)
+
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            def report(offset: int, length: int):
+                if on_data:
+                    on_data(offset, length)
+                if progress:
+                    progress(sum(s.written for s in segments), size)
+
+            tasks = [
+                asyncio.create_task(self._fetch_segment(url, fd, segment, validator, report))
+                for segment in segments
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            os.close(fd)
+
+        logger.info(f"Downloaded {size} bytes from {url} in {len(segments)} segments")
+
+    async def _fetch_segment(
+        self,
+        url: str,
+        fd: int,
+        segment: Segment,
+        validator: Optional[str],
+        report: Callable[[int, int], None]
+    ):
+        while not segment.done:
+            offset = segment.start + segment.written
+            headers = {"Range": f"bytes={offset}-{segment.end}"}
+            if validator:
+                # A changed file comes back as 200 instead of mixing two versions
+                headers["If-Range"] = validator
+
+            try:
+                async with self.session().get(url, headers=headers) as response:
+                    if response.status in RETRY_STATUSES:
+                        raise _SegmentInterrupted(f"HTTP {response.status}")
+                    if response.status != 206:
+                        # 200 here means If-Range failed: the file changed
+                        raise DownloadError(f"Range request answered with HTTP {response.status}")
+
+                    buffer = bytearray()
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        chunk = chunk[:segment.size - segment.written - len(buffer)]
+                        buffer += chunk
+                        if len(buffer) >= WRITE_BLOCK_SIZE:
+                            report(*await self._write(fd, buffer, segment))
+                        if segment.written + len(buffer) >= segment.size:
+                            break
+                    if buffer:
+                        report(*await self._write(fd, buffer, segment))
+
+                    if not segment.done:
+                        raise _SegmentInterrupted("Connection closed before the segment was complete")
+            except (_SegmentInterrupted, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._retry_or_raise(segment, e)
+                await asyncio.sleep(min(2 ** segment.attempts, 30))
+
+    def _retry_or_raise(self, segment: Segment, error: Exception):
+        segment.attempts += 1
+        if segment.attempts >= self.retries:
+            raise DownloadError(
+                f"Segment {segment.start}-{segment.end} failed after {segment.attempts} attempts: {error}"
+            )
+        logger.warning(
+            f"Segment {segment.start}-{segment.end} failed at byte "
+            f"{segment.start + segment.written} (attempt {segment.attempts}), resuming: {error}"
+        )
+
+    @staticmethod
+    async def _write(fd: int, buffer: bytearray, segment: Segment) -> Tuple[int, int]:
+        """Write `buffer` at the segment's position; returns (offset, length)"""
+        offset, length = segment.start + segment.written, len(buffer)
+        await asyncio.to_thread(os.pwrite, fd, bytes(buffer), offset)
+        segment.written += length
+        buffer.clear()
+        return offset, length
+
+    @staticmethod
+    def _total_size(response: aiohttp.ClientResponse) -> Optional[int]:
+        match = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+        return int(match.group(1)) if match else None
@@ -0,0 +1,160 @@
+import uuid
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from .directoryHandler import DatabaseManager
+from .jobs import JobQueue
+from .progress import ProgressTracker, TERMINAL_STATUSES
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url) -> Optional[str]:
+    """Canonical form of an http(s) URL for duplicate checks, or None if it
+    isn't one. Scheme and host are lowercased, default ports and fragments
+    dropped."""
+    if not isinstance(url, str):
+        return None
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+
+    netloc = parts.hostname
+    if ":" in netloc:
+        netloc = f"[{netloc}]"  # IPv6
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    if parts.username:
+        credentials = parts.username + (f":{parts.password}" if parts.password else "")
+        netloc = f"{credentials}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+class BatchImporter:
+    """Bulk URL imports on top of the job queue.
+
+    Each unique URL becomes a "url" job tagged with the batch id, so the
+    queue's global, per-user and per-host limits apply and the batch can be
+    rebuilt from the telegram_jobs table after a restart.
+    """
+
+    def __init__(
+        self,
+        job_queue: JobQueue,
+        db_manager: DatabaseManager,
+        progress: ProgressTracker,
+        max_urls: int
+    ):
+        self.job_queue = job_queue
+        self.db_manager = db_manager
+        self.progress = progress
+        self.max_urls = max_urls
+
+    async def submit(self, items: list, user_id: str, priority: int = 0) -> dict:
+        """Queue `items` (URLs, or {"url", "filename"} dicts) as one batch"""
+        if len(items) > self.max_urls:
+            raise ValueError(f"At most {self.max_urls} URLs per import")
+
+        batch_id = uuid.uuid4().hex
+        payloads, duplicates, invalid = self._dedupe(items)
+        for index, payload in enumerate(payloads):
+            payload.update(batch_id=batch_id, index=index)
+
+        jobs = await self.job_queue.submit_many("url", payloads, user_id=user_id, priority=priority)
+        return {
+            "batch_id": batch_id,
+            "queued": len(jobs),
+            "duplicates": duplicates,
+            "invalid": invalid,
+            "items": [
+                {"index": job.payload["index"], "url": job.payload["url"], "job_id": job.id}
+                for job in jobs
+            ]
+        }
+
+    async def status(self, batch_id: str) -> Optional[dict]:
+        """Aggregate progress of a batch plus the state of every URL"""
+        rows = await self.db_manager.get_batch_jobs(batch_id)
+        if not rows:
+            return None
+
+        items = []
+        counts: dict = {}
+        current = total = 0
+        for row in sorted(rows, key=lambda row: row["payload"].get("index", 0)):
+            # The queue knows about state changes the database may not have yet
+            job = self.job_queue.peek(row["id"]) or row
+            state = self.progress.get(row["id"]) or {}
+            status = job["status"]
+            result = job.get("result") or {}
+            item = {
+                "index": row["payload"].get("index"),
+                "url": row["payload"]["url"],
+                "job_id": row["id"],
+                "status": status,
+                "attempts": job.get("attempts"),
+                "error": job.get("error"),
+                "progress": 100 if status == "completed" else state.get("progress", 0),
+                "current": state.get("current", 0),
+                "total": state.get("total", 0),
+                "speed": state.get("speed"),
+                "file_id": result.get("file_id")
+            }
+            items.append(item)
+            counts[status] = counts.get(status, 0) + 1
+            if status not in TERMINAL_STATUSES:
+                current += item["current"]
+                total += item["total"]
+
+        finished = sum(counts.get(status, 0) for status in TERMINAL_STATUSES)
+        if finished < len(items):
+            batch_status = "running"
+        elif counts.get("completed", 0) == len(items):
+            batch_status = "completed"
+        else:
+            batch_status = "completed_with_errors"
+
+        return {
+            "batch_id": batch_id,
+            "status": batch_status,
+            "total_items": len(items),
+            "counts": counts,
+            "progress": round(sum(item["progress"] for item in items) / len(items), 2),
+            # Of the transfers still in progress
+            "bytes_done": current,
+            "bytes_total": total,
+            "items": items
+        }
+
+    async def cancel(self, batch_id: str) -> Optional[int]:
+        """Cancel the unfinished jobs of a batch; None if the batch is unknown"""
+        rows = await self.db_manager.get_batch_jobs(batch_id)
+        if not rows:
+            return None
+        cancelled = 0
+        for row in rows:
+            if await self.job_queue.cancel(row["id"]):
+                cancelled += 1
+        return cancelled
+
+    @staticmethod
+    def _dedupe(items: list) -> Tuple[List[dict], List[str], List]:
+        """Job payloads for the first occurrence of each valid URL, plus the
+        duplicate and invalid entries that were skipped"""
+        payloads, duplicates, invalid = [], [], []
+        seen = set()
+        for item in items:
+            url, filename = (item.get("url"), item.get("filename")) if isinstance(item, dict) else (item, None)
+            normalized = normalize_url(url)
+            if normalized is None:
+                invalid.append(url)
+            elif normalized in seen:
+                duplicates.append(url)
+            else:
+                seen.add(normalized)
+                payloads.append({"url": url.strip(), "filename": filename})
+        return payloads, duplicates, invalid
@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiofiles
+import magic
+from fastapi import HTTPException
+from multipart.multipart import MultipartParser, parse_options_header
+
+from .extra import sanitize_filename
+
+logger = logging.getLogger(__name__)
+
+SNIFF_BYTES = 8192  # Bytes handed to libmagic for MIME detection
+
+class IngestWriter:
+    """Copy a byte stream to a temp file in fixed-size blocks, hashing and
+    sniffing its MIME type in the same pass"""
+
+    def __init__(self, filename: str, max_size: int, block_size: int):
+        self.filename = filename
+        self.max_size = max_size
+        self.block_size = block_size
+        self.size = 0
+        self.path: Optional[str] = None
+        self._file = None
+        self._buffer = bytearray()
+        self._head = bytearray()
+        self._hasher = hashlib.sha256()
+
+    async def open(self):
+        with tempfile.NamedTemporaryFile(
+            delete=False,
+            suffix=f"_{sanitize_filename(self.filename)}"
+        ) as tmp:
+            self.path = tmp.name
+        self._file = await aiofiles.open(self.path, "wb")
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large: more than {self.max_size} bytes"
+            )
+
+        self._hasher.update(data)
+        if len(self._head) < SNIFF_BYTES:
+            self._head += data[:SNIFF_BYTES - len(self._head)]
+
+        self._buffer += data
+        if len(self._buffer) >= self.block_size:
+            await self._file.write(bytes(self._buffer))
+            self._buffer.clear()
+
+    async def close(self) -> dict:
+        if self._buffer:
+            await self._file.write(bytes(self._buffer))
+            self._buffer.clear()
+        await self._file.close()
+
+        return {
+            "path": self.path,
+            "filename": self.filename,
+            "size": self.size,
+            "sha256": self._hasher.hexdigest(),
+            "mime_type": magic.from_buffer(bytes(self._head), mime=True) if self._head else "application/octet-stream"
+        }
+
+    async def discard(self):
+        if self._file is not None:
+            await self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+def _hash_file(path: str, block_size: int) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+async def hash_file(path: str, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file on disk, read in blocks off the event loop"""
+    return await asyncio.to_thread(_hash_file, path, block_size)
+
+async def ingest_multipart(
+    content_type: str,
+    stream: AsyncIterator[bytes],
+    max_size: int,
+    block_size: int = 1024 * 1024,
+    max_field_size: int = 64 * 1024
+) -> Tuple[dict, Dict[str, str]]:
+    """Parse a multipart/form-data body with exactly one file part.
+
+    The file goes straight to a temp file without being held in memory.
+    Returns (file info, other form fields); file info has path, filename,
+    size, sha256 and mime_type.
+    """
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing multipart boundary")
+
+    fields: Dict[str, str] = {}
+    state = {"name": None, "filename": None, "data": bytearray(), "header": b"", "value": b"", "disposition": b""}
+    # Callbacks are synchronous, so queue file events and handle them with await after each write
+    events: List[tuple] = []
+
+    def on_part_begin():
+        state.update(name=None, filename=None, data=bytearray(), disposition=b"")
+
+    def on_header_field(data, start, end):
+        state["header"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        if state["header"].lower() == b"content-disposition":
+            state["disposition"] = state["value"]
+        state["header"] = b""
+        state["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["disposition"])
+        state["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            state["filename"] = options[b"filename"].decode("utf-8", "replace") or "upload"
+            events.append(("file_begin", state["filename"]))
+
+    def on_part_data(data, start, end):
+        if state["filename"] is not None:
+            events.append(("file_data", data[start:end]))
+        else:
+            state["data"] += data[start:end]
+            if len(state["data"]) > max_field_size:
+                raise HTTPException(status_code=413, detail=f"Form field {state['name']} too large")
+
+    def on_part_end():
+        if state["filename"] is None and state["name"]:
+            fields[state["name"]] = state["data"].decode("utf-8", "replace")
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    writer: Optional[IngestWriter] = None
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+            for event in events:
+                if event[0] == "file_begin":
+                    if writer is not None:
+                        raise HTTPException(status_code=400, detail="Only one file per upload")
+                    writer = IngestWriter(event[1], max_size, block_size)
+                    await writer.open()
+                else:
+                    await writer.write(event[1])
+            events.clear()
+        parser.finalize()
+
+        if writer is None:
+            raise HTTPException(status_code=400, detail="No file in upload")
+        return await writer.close(), fields
+    except Exception:
+        if writer is not None:
+            await writer.discard()
+        raise
@@ -0,0 +1,376 @@
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .cache import TTLCache
+from .directoryHandler import DatabaseManager
+from .progress import ProgressTracker
+
+logger = logging.getLogger(__name__)
+
+class PermanentJobError(Exception):
+    """Raised by a job handler for failures that retrying will not fix"""
+
+class Job:
+    def __init__(
+        self,
+        kind: str,
+        payload: dict,
+        user_id: Optional[str] = None,
+        priority: int = 0,
+        job_id: Optional[str] = None,
+        status: str = "queued",
+        attempts: int = 0,
+        created_at: Optional[str] = None
+    ):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.user_id = user_id
+        self.priority = priority
+        self.status = status
+        self.attempts = attempts
+        self.error: Optional[str] = None
+        self.result: Optional[dict] = None
+        self.created_at = created_at or datetime.now(timezone.utc).isoformat()
+        self.not_before = 0.0  # monotonic time before which a retry must not start
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Job":
+        return cls(
+            row["kind"],
+            row.get("payload") or {},
+            user_id=row.get("user_id"),
+            priority=row.get("priority") or 0,
+            job_id=row["id"],
+            status=row.get("status", "queued"),
+            attempts=row.get("attempts") or 0,
+            created_at=row.get("created_at")
+        )
+
+    def to_row(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "user_id": self.user_id,
+            "payload": self.payload,
+            "priority": self.priority,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }
+
+    @property
+    def host(self) -> Optional[str]:
+        """Host a URL job fetches from"""
+        url = self.payload.get("url")
+        return urlsplit(url).hostname if url else None
+
+Handler = Callable[[Job], Awaitable[Optional[dict]]]
+Cleanup = Callable[[Job], Any]
+
+class JobQueue:
+    """Run uploads and URL imports with bounded concurrency.
+
+    At most `max_concurrent` jobs run at once, at most `max_per_user` of
+    them for the same user and at most `max_per_host` fetching from the
+    same host (for jobs whose payload has a "url"). Higher priority jobs start first, failed jobs
+    are retried with exponential backoff, and every state change is written
+    to the telegram_jobs table so pending work is resumed after a restart.
+    Job ids double as progress task ids when a ProgressTracker is given.
+    """
+
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        max_concurrent: int,
+        max_per_user: int,
+        max_attempts: int,
+        retry_delay: float,
+        history_size: int = 1000,
+        history_ttl: int = 3600,
+        progress: Optional[ProgressTracker] = None,
+        max_per_host: Optional[int] = None
+    ):
+        self.db_manager = db_manager
+        self.progress = progress
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_user = max(1, max_per_user)
+        self.max_per_host = max(1, max_per_host or self.max_concurrent)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self._handlers: Dict[str, Tuple[Handler, Optional[Cleanup]]] = {}
+        self._pending: Dict[str, Job] = {}  # queued or waiting to retry
+        self._running: Dict[str, Tuple[Job, asyncio.Task]] = {}
+        self._started: set = set()  # ids of running jobs whose _run() has begun
+        # Running jobs per ("user", id) and ("host", name) limit key
+        self._key_running: Dict[Tuple[str, str], int] = {}
+        self._order: Dict[str, int] = {}  # FIFO tie-break within a priority
+        self._sequence = itertools.count()
+        # Finished jobs, kept for a while so clients can read the outcome
+        self._history = TTLCache(history_size, history_ttl)
+        self._wakeup = asyncio.Event()
+        self._workers: list = []
+        self._stopping = False
+
+    def register(self, kind: str, handler: Handler, cleanup: Optional[Cleanup] = None):
+        """Set the coroutine that runs jobs of `kind`. `cleanup` is called once
+        a job of that kind has failed for good or was cancelled."""
+        self._handlers[kind] = (handler, cleanup)
+
+    async def start(self):
+        """Requeue jobs left over from the previous run and start the workers"""
+        for row in await self.db_manager.get_pending_jobs():
+            if row.get("kind") not in self._handlers:
+                logger.warning(f"Skipping job {row.get('id')} of unknown kind {row.get('kind')}")
+                continue
+            job = Job.from_row(row)
+            job.status = "queued"
+            self._enqueue(job)
+        if self._pending:
+            logger.info(f"Resumed {len(self._pending)} pending jobs")
+
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent)]
+
+    async def stop(self):
+        """Stop the workers. Running jobs stay marked as running in the
+        database, so they start again on the next startup."""
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(
+        self,
+        kind: str,
+        payload: dict,
+        user_id: Optional[str] = None,
+        priority: int = 0
+    ) -> Job:
+        """Queue a job; higher `priority` runs sooner"""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job = Job(kind, payload, user_id=user_id, priority=priority)
+        await self.db_manager.save_job(job.to_row())
+        self._enqueue(job)
+        return job
+
+    async def submit_many(
+        self,
+        kind: str,
+        payloads: List[dict],
+        user_id: Optional[str] = None,
+        priority: int = 0
+    ) -> List[Job]:
+        """Queue several jobs of one kind, saved in a single write.
+        They start in the order given."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        jobs = [Job(kind, payload, user_id=user_id, priority=priority) for payload in payloads]
+        if jobs:
+            await self.db_manager.save_jobs([job.to_row() for job in jobs])
+        for job in jobs:
+            self._enqueue(job)
+        return jobs
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job. Returns False if it isn't active."""
+        job = self._pending.pop(job_id, None)
+        if job is not None:
+            await self._finish(job, "cancelled")
+            return True
+
+        running = self._running.get(job_id)
+        if running is not None:
+            job, task = running
+            task.cancel()
+            if job_id not in self._started:
+                # The task never ran, so _run() won't record the cancellation
+                self._release(job)
+                await self._finish(job, "cancelled")
+            return True
+        return False
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        state = self.peek(job_id)
+        if state is not None:
+            return state
+
+        row = await self.db_manager.get_job(job_id)
+        if row is None:
+            return None
+        return self._describe(Job.from_row(row), error=row.get("error"), result=row.get("result"))
+
+    def peek(self, job_id: str) -> Optional[dict]:
+        """State of an active or recently finished job, without a database read"""
+        job = self._pending.get(job_id) or (self._running.get(job_id) or (None,))[0]
+        if job is not None:
+            return self._describe(job)
+        return self._history.get(job_id)
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(1 for job in self._pending.values() if job.status == "queued"),
+            "retrying": sum(1 for job in self._pending.values() if job.status == "retrying"),
+            "running": len(self._running),
+            "max_concurrent": self.max_concurrent,
+            "max_per_user": self.max_per_user,
+            "max_per_host": self.max_per_host
+        }
+
+    def _enqueue(self, job: Job):
+        if self.progress and job.status == "queued":
+            self.progress.start(job.id, "queued", kind=job.kind)
+        self._pending[job.id] = job
+        self._order.setdefault(job.id, next(self._sequence))
+        self._wakeup.set()
+
+    def _pick(self) -> Optional[Job]:
+        now = time.monotonic()
+        best = None
+        for job in self._pending.values():
+            if job.not_before > now:
+                continue
+            if any(self._key_running.get(key, 0) >= limit for key, limit in self._limits(job)):
+                continue
+            if best is None or (-job.priority, self._order[job.id]) < (-best.priority, self._order[best.id]):
+                best = job
+        return best
+
+    def _limits(self, job: Job) -> List[Tuple[Tuple[str, str], int]]:
+        """The (limit key, max running) pairs a job counts against"""
+        limits = []
+        if job.user_id:
+            limits.append((("user", job.user_id), self.max_per_user))
+        host = job.host
+        if host:
+            limits.append((("host", host), self.max_per_host))
+        return limits
+
+    async def _next_job(self) -> Job:
+        while True:
+            job = self._pick()
+            if job is not None:
+                del self._pending[job.id]
+                for key, _ in self._limits(job):
+                    self._key_running[key] = self._key_running.get(key, 0) + 1
+                return job
+            # No await between _pick() and clear(), so no wakeup is lost
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            task = asyncio.create_task(self._run(job))
+            self._running[job.id] = (job, task)
+            try:
+                await task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # stop() cancelled the worker itself
+            except Exception as e:
+                logger.error(f"Job {job.id} ({job.kind}) crashed: {e}")
+            if job.id in self._running:
+                # Cancelled before _run() began, so its finally never ran
+                self._release(job)
+                await self._finish(job, "cancelled")
+
+    async def _run(self, job: Job):
+        self._started.add(job.id)
+        handler, _ = self._handlers[job.kind]
+        try:
+            job.status = "running"
+            job.attempts += 1
+            job.error = None
+            await self.db_manager.save_job(job.to_row())
+            if self.progress:
+                self.progress.set_status(job.id, "running", attempts=job.attempts)
+
+            result = await handler(job)
+        except asyncio.CancelledError:
+            if self._stopping:
+                raise
+            await self._finish(job, "cancelled")
+        except PermanentJobError as e:
+            await self._finish(job, "failed", error=str(e))
+        except Exception as e:
+            if job.attempts >= self.max_attempts:
+                logger.error(f"Job {job.id} ({job.kind}) failed after {job.attempts} attempts: {e}")
+                await self._finish(job, "failed", error=str(e))
+            else:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                logger.warning(f"Job {job.id} ({job.kind}) failed, retrying in {delay:.0f}s: {e}")
+                job.status = "retrying"
+                job.error = str(e)
+                job.not_before = time.monotonic() + delay
+                await self.db_manager.save_job(job.to_row())
+                if self.progress:
+                    self.progress.set_status(job.id, "retrying", error=job.error, retry_in=delay)
+                self._enqueue(job)
+                asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+        else:
+            await self._finish(job, "completed", result=result)
+        finally:
+            self._release(job)
+
+    def _release(self, job: Job):
+        """Free a running job's slot and limit counters; safe to call twice"""
+        if self._running.pop(job.id, None) is None:
+            return
+        self._started.discard(job.id)
+        for key, _ in self._limits(job):
+            self._key_running[key] -= 1
+            if not self._key_running[key]:
+                del self._key_running[key]
+        self._wakeup.set()
+
+    async def _finish(
+        self,
+        job: Job,
+        status: str,
+        error: Optional[str] = None,
+        result: Optional[dict] = None
+    ):
+        job.status = status
+        job.error = error
+        job.result = result
+        self._order.pop(job.id, None)
+        self._history.set(job.id, self._describe(job))
+        await self.db_manager.save_job(job.to_row())
+        if self.progress:
+            self.progress.set_status(job.id, status, error=error, result=result)
+
+        _, cleanup = self._handlers[job.kind]
+        if cleanup and status != "completed":
+            try:
+                outcome = cleanup(job)
+                if asyncio.iscoroutine(outcome):
+                    await outcome
+            except Exception as e:
+                logger.error(f"Cleanup for job {job.id} failed: {e}")
+
+    def _describe(self, job: Job, error: Optional[str] = None, result: Optional[dict] = None) -> dict:
+        return {
+            "job_id": job.id,
+            "kind": job.kind,
+            "user_id": job.user_id,
+            "status": job.status,
+            "priority": job.priority,
+            "attempts": job.attempts,
+            "max_attempts": self.max_attempts,
+            "error": job.error or error,
+            "result": job.result or result,
+            "created_at": job.created_at
+        }
@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import math
+import os
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+import aiofiles
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import FilePartMissing, FloodWait
+from pyrogram.session import Session
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024  # Largest part size Telegram accepts
+BIG_FILE_SIZE = 10 * 1024 * 1024  # Files above this must use SaveBigFilePart
+
+class PartUploadError(Exception):
+    """A file part could not be uploaded after all retries"""
+
+class PartAssembler:
+    """Turn byte ranges landing in a file, in any order, into complete
+    upload parts. Pass `written` as a downloader's on_data hook and
+    `parts()` to ParallelPartUploader.upload_parts()."""
+
+    def __init__(self, path: str, file_size: int):
+        self.path = path
+        self.file_size = file_size
+        self.total_parts = math.ceil(file_size / PART_SIZE)
+        self._filled = [0] * self.total_parts
+        self._ready: asyncio.Queue = asyncio.Queue()
+
+    def written(self, offset: int, length: int):
+        """Record that `length` bytes at `offset` are on disk"""
+        end = offset + length
+        for index in range(offset // PART_SIZE, min(math.ceil(end / PART_SIZE), self.total_parts)):
+            part_start = index * PART_SIZE
+            overlap = min(end, part_start + PART_SIZE) - max(offset, part_start)
+            self._filled[index] += overlap
+            if self._filled[index] == self._part_size(index):
+                self._ready.put_nowait(index)
+
+    def fail(self, error: BaseException):
+        """Stop parts() with `error`, e.g. when the download fails"""
+        self._ready.put_nowait(error)
+
+    async def parts(self) -> AsyncIterator[Tuple[int, bytes]]:
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            for _ in range(self.total_parts):
+                index = await self._ready.get()
+                if isinstance(index, BaseException):
+                    raise index
+                data = await asyncio.to_thread(os.pread, fd, self._part_size(index), index * PART_SIZE)
+                yield index, data
+        finally:
+            os.close(fd)
+
+    def _part_size(self, index: int) -> int:
+        return min(PART_SIZE, self.file_size - index * PART_SIZE)
+
+class ParallelPartUploader:
+    """Upload big files as parts sent concurrently over several MTProto connections.
+
+    Parts of one file must all be uploaded by the same account, so the
+    parallelism is over several media sessions of that client rather than
+    over different clients.
+    """
+
+    def __init__(self, workers: int, connections: int, retries: int):
+        self.workers = max(1, workers)
+        self.connections = max(1, min(connections, self.workers))
+        self.retries = max(1, retries)
+
+    async def upload_path(
+        self,
+        client: Client,
+        path: str,
+        file_name: str,
+        progress: Optional[Callable[[int, int], None]] = None
+    ) -> raw.types.InputFileBig:
+        """Upload a file on disk and return the InputFile to attach to a message"""
+        file_size = os.path.getsize(path)
+        return await self.upload_parts(client, self.read_parts(path), file_size, file_name, progress)
+
+    async def upload_parts(
+        self,
+        client: Client,
+        parts: AsyncIterator[Tuple[int, bytes]],
+        file_size: int,
+        file_name: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+        file_id: Optional[int] = None
+    ) -> raw.types.InputFileBig:
+        """Upload (part index, bytes) pairs as they arrive.
+
+        The queue between `parts` and the workers is bounded, so a slow
+        upload applies backpressure to whatever produces the parts.
+        """
+        if file_size <= BIG_FILE_SIZE:
+            raise ValueError(f"Parallel part upload needs a file over {BIG_FILE_SIZE} bytes")
+
+        total_parts = math.ceil(file_size / PART_SIZE)
+        file_id = file_id or client.rnd_id()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        uploaded = 0
+
+        sessions = await self._start_sessions(client, self.connections)
+
+        async def worker(session: Session):
+            nonlocal uploaded
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                index, data = item
+                await self._save_part(session, file_id, index, total_parts, data)
+                uploaded += len(data)
+                if progress:
+                    progress(min(uploaded, file_size), file_size)
+
+        tasks = [
+            asyncio.create_task(worker(sessions[i % len(sessions)]))
+            for i in range(self.workers)
+        ]
+
+        async def feed(item):
+            # Wait for queue space, but stop as soon as a worker gives up on a part
+            put = asyncio.ensure_future(queue.put(item))
+            done, _ = await asyncio.wait([put, *tasks], return_when=asyncio.FIRST_COMPLETED)
+            if put not in done:
+                put.cancel()
+                raise next(
+                    (t.exception() for t in done if t.exception()),
+                    PartUploadError("Upload worker stopped unexpectedly")
+                )
+
+        try:
+            async for item in parts:
+                await feed(item)
+            for _ in tasks:
+                await feed(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._stop_sessions(sessions)
+
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+
+    async def send_media(
+        self,
+        client: Client,
+        chat_id: int,
+        path: str,
+        file_info: dict,
+        progress: Optional[Callable[[int, int], None]] = None
+    ) -> types.Message:
+        """Upload a file with parallel parts and post it as a media message"""
+        input_file = await self.upload_path(client, path, file_info["filename"], progress)
+        return await self.finalize(client, chat_id, input_file, file_info, path=path)
+
+    async def finalize(
+        self,
+        client: Client,
+        chat_id: int,
+        input_file: raw.types.InputFileBig,
+        file_info: dict,
+        path: Optional[str] = None
+    ) -> types.Message:
+        """Send the uploaded parts as a message, re-sending any part Telegram
+        reports missing, up to `retries` times"""
+        media = raw.types.InputMediaUploadedDocument(
+            mime_type=file_info["mime_type"],
+            file=input_file,
+            attributes=self._attributes(file_info)
+        )
+
+        resent = 0
+        while True:
+            try:
+                r = await client.invoke(
+                    raw.functions.messages.SendMedia(
+                        peer=await client.resolve_peer(chat_id),
+                        media=media,
+                        random_id=client.rnd_id(),
+                        **await utils.parse_text_entities(client, file_info["filename"], None, None)
+                    )
+                )
+            except FilePartMissing as e:
+                if path is None:
+                    raise
+                resent += 1
+                if resent > self.retries:
+                    raise PartUploadError(f"Parts still missing after {self.retries} re-sends: {e}") from e
+                logger.warning(f"Telegram reports part {e.value} missing, re-sending it")
+                await self._resend_part(client, path, input_file, e.value)
+                continue
+
+            for update in r.updates:
+                if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+                    return await types.Message._parse(
+                        client, update.message,
+                        {u.id: u for u in r.users},
+                        {c.id: c for c in r.chats}
+                    )
+            raise PartUploadError("SendMedia returned no message")
+
+    @staticmethod
+    async def read_parts(path: str, first_part: int = 0) -> AsyncIterator[Tuple[int, bytes]]:
+        async with aiofiles.open(path, "rb") as f:
+            await f.seek(first_part * PART_SIZE)
+            index = first_part
+            while True:
+                data = await f.read(PART_SIZE)
+                if not data:
+                    return
+                yield index, data
+                index += 1
+
+    async def _start_sessions(self, client: Client, count: int) -> list:
+        dc_id = await client.storage.dc_id()
+        auth_key = await client.storage.auth_key()
+        test_mode = await client.storage.test_mode()
+
+        sessions = [
+            Session(client, dc_id, auth_key, test_mode, is_media=True)
+            for _ in range(count)
+        ]
+        try:
+            await asyncio.gather(*(session.start() for session in sessions))
+        except Exception:
+            await self._stop_sessions(sessions)
+            raise
+        return sessions
+
+    @staticmethod
+    async def _stop_sessions(sessions: list):
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception as e:
+                logger.debug(f"Error stopping upload session: {e}")
+
+    async def _save_part(self, session: Session, file_id: int, index: int, total_parts: int, data: bytes):
+        attempt = 0
+        while True:
+            try:
+                await session.invoke(
+                    raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id,
+                        file_part=index,
+                        file_total_parts=total_parts,
+                        bytes=data
+                    )
+                )
+                return
+            except FloodWait as e:
+                logger.warning(f"FloodWait uploading part {index}, sleeping {e.value}s")
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.retries:
+                    raise PartUploadError(f"Part {index} failed after {attempt} attempts: {e}") from e
+                logger.warning(f"Part {index} upload failed (attempt {attempt}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def _resend_part(self, client: Client, path: str, input_file: raw.types.InputFileBig, index: int):
+        async with aiofiles.open(path, "rb") as f:
+            await f.seek(index * PART_SIZE)
+            data = await f.read(PART_SIZE)
+
+        session, = await self._start_sessions(client, 1)
+        try:
+            await self._save_part(session, input_file.id, index, input_file.parts, data)
+        finally:
+            await self._stop_sessions([session])
+
+    @staticmethod
+    def _attributes(file_info: dict) -> list:
+        attributes = [raw.types.DocumentAttributeFilename(file_name=file_info["filename"])]
+        mime_type = file_info["mime_type"]
+
+        if mime_type.startswith("video/"):
+            attributes.append(raw.types.DocumentAttributeVideo(
+                supports_streaming=file_info.get("supports_streaming") or None,
+                duration=int(file_info.get("duration") or 0),
+                w=int(file_info.get("width") or 0),
+                h=int(file_info.get("height") or 0)
+            ))
+        elif mime_type.startswith("audio/"):
+            attributes.append(raw.types.DocumentAttributeAudio(
+                duration=int(file_info.get("duration") or 0)
+            ))
+        return attributes
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Optional
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+class _Task:
+    def __init__(self, task_id: str):
+        self.state: dict = {"task_id": task_id}
+        self.changed = asyncio.Event()
+        self.last_publish = 0.0
+        # Throughput sampling
+        self.sample_time = time.monotonic()
+        self.sample_bytes = 0
+        self.speed: Optional[float] = None
+
+class ProgressTracker:
+    """Progress of uploads, URL imports and restores, keyed by task id.
+
+    Finished tasks are dropped `ttl` seconds after they end (and the oldest
+    ones once more than `max_finished` pile up). Byte progress updates are
+    published to subscribers at most every `min_interval` seconds; status
+    changes are published immediately.
+    """
+
+    def __init__(self, ttl: int = 600, max_finished: int = 1000, min_interval: float = 0.5):
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.min_interval = min_interval
+        self._tasks: Dict[str, _Task] = {}
+        # task_id -> monotonic time it finished, oldest first
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+
+    def start(self, task_id: str, status: str = "queued", **fields):
+        """Create (or reset) a task's progress"""
+        self._expire()
+        self._finished.pop(task_id, None)
+        old = self._tasks.get(task_id)
+        task = _Task(task_id)
+        if old is not None:
+            # Keep waking subscribers of the previous entry
+            task.changed = old.changed
+        task.state.update(status=status, progress=0, current=0, total=0, speed=None, eta=None, **fields)
+        task.state["updated_at"] = time.time()
+        self._tasks[task_id] = task
+        self._publish(task)
+
+    def update(self, task_id: str, current: int, total: int):
+        """Record bytes done out of `total`, e.g. from a Pyrogram progress callback"""
+        task = self._tasks.get(task_id)
+        if task is None:
+            return
+
+        now = time.monotonic()
+        elapsed = now - task.sample_time
+        if current < task.sample_bytes:
+            # Restarted, e.g. a new phase or a retry
+            task.sample_time, task.sample_bytes, task.speed = now, current, None
+        elif elapsed >= self.min_interval:
+            rate = (current - task.sample_bytes) / elapsed
+            # Smooth out bursty callbacks
+            task.speed = rate if task.speed is None else 0.7 * task.speed + 0.3 * rate
+            task.sample_time, task.sample_bytes = now, current
+
+        state = task.state
+        state["current"] = current
+        state["total"] = total
+        state["progress"] = round(current / total * 100, 2) if total > 0 else 0
+        state["speed"] = round(task.speed) if task.speed is not None else None
+        state["eta"] = round((total - current) / task.speed, 1) if task.speed and total > current else None
+        state["updated_at"] = time.time()
+
+        if now - task.last_publish >= self.min_interval:
+            self._publish(task)
+
+    def set_status(self, task_id: str, status: str, **fields):
+        """Change a task's status; completed, failed and cancelled end it"""
+        task = self._tasks.get(task_id)
+        if task is None:
+            self.start(task_id, status, **fields)
+            task = self._tasks[task_id]
+        else:
+            task.state.update(status=status, **fields)
+            task.state["updated_at"] = time.time()
+
+        if status in TERMINAL_STATUSES:
+            task.state["speed"] = task.state["eta"] = None
+            if status == "completed":
+                task.state["progress"] = 100
+            self._finished[task_id] = time.monotonic()
+            self._finished.move_to_end(task_id)
+        self._publish(task)
+        self._expire()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        task = self._tasks.get(task_id)
+        return dict(task.state) if task else None
+
+    async def subscribe(self, task_id: str, keepalive: float = 15) -> AsyncGenerator[Optional[dict], None]:
+        """Yield the task's state whenever it is published, ending after a
+        terminal status. Yields None every `keepalive` seconds without news."""
+        while True:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return
+
+            changed = task.changed
+            state = dict(task.state)
+            yield state
+            if state.get("status") in TERMINAL_STATUSES:
+                return
+
+            while not changed.is_set():
+                try:
+                    await asyncio.wait_for(asyncio.shield(changed.wait()), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+
+    def stats(self) -> dict:
+        return {
+            "tasks": len(self._tasks),
+            "active": len(self._tasks) - len(self._finished)
+        }
+
+    def _publish(self, task: _Task):
+        task.last_publish = time.monotonic()
+        # Wake current subscribers; they wait on the fresh event next
+        task.changed.set()
+        task.changed = asyncio.Event()
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._finished:
+            task_id, finished_at = next(iter(self._finished.items()))
+            if finished_at > deadline and len(self._finished) <= self.max_finished:
+                break
+            del self._finished[task_id]
+            self._tasks.pop(task_id, None)
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class ChunkCache:
+    """Disk-backed LRU cache of file chunks keyed by (telegram_file_id, chunk index)"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        # cache key -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def initialize(self):
+        """Rebuild the index from chunks left on disk by a previous run"""
+        if not self.enabled:
+            return
+        entries = await asyncio.to_thread(self._scan)
+        for key, size in entries:
+            self._entries[key] = size
+            self._total_bytes += size
+        await self._evict()
+        logger.info(f"Chunk cache ready: {len(self._entries)} chunks, {self._total_bytes} bytes")
+
+    async def get(self, file_id: str, index: int) -> Optional[bytes]:
+        """Return a cached chunk or None"""
+        if not self.enabled:
+            return None
+
+        key = self._key(file_id, index)
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        try:
+            data = await asyncio.to_thread(self._read, self._path(key))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache chunk {key}: {e}")
+            self._forget(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    async def put(self, file_id: str, index: int, data: bytes):
+        """Store a chunk, evicting least recently used chunks over the size cap"""
+        if not self.enabled or not data or len(data) > self.max_bytes:
+            return
+
+        key = self._key(file_id, index)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        try:
+            await asyncio.to_thread(self._write, self._path(key), data)
+        except OSError as e:
+            logger.warning(f"Chunk cache write failed: {e}")
+            return
+
+        if key in self._entries:
+            return
+        self._entries[key] = len(data)
+        self._total_bytes += len(data)
+        await self._evict()
+
+    def stats(self) -> dict:
+        """Cache counters for the stats endpoint"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "chunks": len(self._entries),
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0
+        }
+
+    async def _evict(self):
+        victims = []
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            victims.append(self._path(key))
+        if victims:
+            await asyncio.to_thread(self._unlink_all, victims)
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _key(self, file_id: str, index: int) -> str:
+        return hashlib.sha1(f"{file_id}:{index}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.chunk")
+
+    def _scan(self) -> list:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if not name.endswith(".chunk"):
+                    # Leftover from a write interrupted by a crash
+                    self._unlink_all([path])
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_atime, name[:-len(".chunk")], stat.st_size))
+        found.sort()
+        return [(key, size) for _, key, size in found]
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        # Write to a temp file and rename so readers never see a partial chunk
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _unlink_all(paths: list):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
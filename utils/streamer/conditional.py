@@ -0,0 +1,148 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import List, Mapping, Optional, Tuple
+
+MAX_RANGES = 16  # More ranges than this in one request are served as the whole file
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlap the file"""
+
+def entity_tag(file_info: dict) -> str:
+    """Strong ETag for a catalog row. The bytes behind a Telegram file id
+    never change, so the content hash (or the file id itself) identifies them."""
+    source = file_info.get("sha256") or "{}:{}:{}".format(
+        file_info.get("telegram_file_id"),
+        file_info.get("telegram_message_id"),
+        file_info.get("file_size")
+    )
+    return '"' + hashlib.sha256(source.encode()).hexdigest()[:32] + '"'
+
+def modified_at(file_info: dict) -> Optional[datetime]:
+    """uploaded_at as a UTC datetime truncated to whole seconds, as HTTP dates are"""
+    value = file_info.get("uploaded_at")
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).replace(microsecond=0)
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(moment, usegmt=True)
+
+def _parse_date(value: str) -> Optional[datetime]:
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment is None:
+        return None
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def _tags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+def _strong_match(header: str, etag: str) -> bool:
+    return any(tag == "*" or tag == etag for tag in _tags(header))
+
+def _weak_match(header: str, etag: str) -> bool:
+    return any(tag == "*" or tag.removeprefix("W/") == etag for tag in _tags(header))
+
+def check_preconditions(
+    headers: Mapping[str, str],
+    etag: str,
+    last_modified: Optional[datetime],
+    method: str = "GET"
+) -> Optional[int]:
+    """Evaluate If-Match, If-Unmodified-Since, If-None-Match and
+    If-Modified-Since in the order RFC 9110 section 13.2.2 gives. Returns
+    304 or 412 when the request should stop there, None to carry on."""
+    if_match = headers.get("if-match")
+    if if_match is not None:
+        if not _strong_match(if_match, etag):
+            return 412
+    elif last_modified is not None:
+        since = _parse_date(headers.get("if-unmodified-since") or "")
+        if since is not None and last_modified > since:
+            return 412
+
+    safe = method in ("GET", "HEAD")
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if _weak_match(if_none_match, etag):
+            return 304 if safe else 412
+    elif safe and last_modified is not None:
+        since = _parse_date(headers.get("if-modified-since") or "")
+        if since is not None and last_modified <= since:
+            return 304
+    return None
+
+def if_range_matches(headers: Mapping[str, str], etag: str, last_modified: Optional[datetime]) -> bool:
+    """Whether a Range request may be honoured. Without If-Range it always
+    may; with one, only if it names the current representation."""
+    value = headers.get("if-range")
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith(("\"", "W/")):
+        # Weak tags never match If-Range
+        return value == etag
+    since = _parse_date(value)
+    return since is not None and last_modified is not None and since == last_modified
+
+def parse_ranges(header: Optional[str], file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """Byte ranges of a Range header as sorted, merged (start, end) pairs,
+    end inclusive. Returns None when the header should be ignored (missing,
+    malformed, not bytes, or too many ranges), in which case the whole file
+    is sent. Raises RangeNotSatisfiable if no range overlaps the file."""
+    if not header or file_size <= 0:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    specs = [part.strip() for part in spec.split(",")]
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in specs:
+        start_str, dash, end_str = part.partition("-")
+        start_str, end_str = start_str.strip(), end_str.strip()
+        if not dash or not (start_str or end_str):
+            return None
+        if (start_str and not start_str.isdigit()) or (end_str and not end_str.isdigit()):
+            return None
+
+        if not start_str:
+            # bytes=-500: the last 500 bytes
+            length = int(end_str)
+            if length == 0:
+                continue
+            ranges.append((max(0, file_size - length), file_size - 1))
+            continue
+
+        start = int(start_str)
+        if end_str and int(end_str) < start:
+            return None
+        if start >= file_size:
+            continue
+        ranges.append((start, min(int(end_str), file_size - 1) if end_str else file_size - 1))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    # Overlapping or adjacent ranges are served once
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
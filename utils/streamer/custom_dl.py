@@ -1,49 +1,159 @@
 
-import asyncio
 import logging
-from typing import Optional, Tuple
+import uuid
+from typing import Awaitable, Callable, List, Mapping, Optional, Tuple
+from urllib.parse import quote
 from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
-from pyrogram import Client
-from pyrogram.errors import FloodWait
-import io
+from fastapi.responses import Response, StreamingResponse
 
 from ..clients import TelegramManager
+from .chunk_cache import ChunkCache
+from .conditional import (
+    RangeNotSatisfiable,
+    check_preconditions,
+    entity_tag,
+    http_date,
+    if_range_matches,
+    modified_at,
+    parse_ranges
+)
+from .parallel import ParallelChunkFetcher
+from .readahead import ReadAheadScheduler
 
 logger = logging.getLogger(__name__)
 
 class ByteStreamer:
     def __init__(self, telegram_manager: TelegramManager):
         self.telegram_manager = telegram_manager
-        self.chunk_size = 1024 * 1024  # 1MB chunks
+        self.chunk_size = 1024 * 1024  # 1MB chunks, same as pyrogram stream_media parts
+        settings = telegram_manager.settings
+        self.cache_control = settings.STREAM_CACHE_CONTROL
+        self.cache = ChunkCache(settings.CHUNK_CACHE_DIR, settings.CHUNK_CACHE_MAX_BYTES)
+        self.fetcher = ParallelChunkFetcher(
+            telegram_manager,
+            self.chunk_size,
+            concurrency=settings.STREAM_PARALLEL_FETCHES,
+            window=settings.STREAM_READAHEAD_CHUNKS,
+            cache=self.cache
+        )
+        self.readahead = ReadAheadScheduler(
+            self.fetcher,
+            self.chunk_size,
+            depth=settings.STREAM_READAHEAD_CHUNKS,
+            budget=settings.STREAM_READAHEAD_BUDGET,
+            idle_ttl=settings.STREAM_READAHEAD_IDLE_TTL,
+            max_streams=settings.STREAM_READAHEAD_MAX_STREAMS
+        )
         
-    async def stream_full(self, file_id: str, file_info: dict) -> StreamingResponse:
+    async def initialize(self):
+        """Load the on-disk chunk cache index and start dropping idle read-ahead streams"""
+        await self.cache.initialize()
+        self.readahead.start()
+        
+    async def close(self):
+        await self.readahead.stop()
+        
+    async def respond(
+        self,
+        file_id: str,
+        file_info: dict,
+        request_headers: Mapping[str, str],
+        method: str = "GET",
+        client_ip: Optional[str] = None,
+        attachment: bool = False
+    ) -> Response:
+        """Answer a GET or HEAD for a file, honouring conditional and Range
+        headers. Validators come from the catalog row, so HEAD, 304, 412
+        and 416 responses never reach Telegram."""
+        file_size = file_info.get("file_size") or 0
+        etag = entity_tag(file_info)
+        last_modified = modified_at(file_info)
+        
+        headers = {
+            "ETag": etag,
+            "Cache-Control": self.cache_control,
+            "Accept-Ranges": "bytes"
+        }
+        if last_modified:
+            headers["Last-Modified"] = http_date(last_modified)
+        if attachment:
+            headers["Content-Disposition"] = content_disposition(file_info.get("file_name") or "download")
+        
+        status = check_preconditions(request_headers, etag, last_modified, method)
+        if status is not None:
+            return Response(status_code=status, headers=headers)
+        
+        ranges = None
+        range_header = request_headers.get("range")
+        if range_header and if_range_matches(request_headers, etag, last_modified):
+            try:
+                ranges = parse_ranges(range_header, file_size)
+            except RangeNotSatisfiable:
+                return Response(
+                    status_code=416,
+                    headers={**headers, "Content-Range": f"bytes */{file_size}"}
+                )
+        
+        head = method == "HEAD"
+        if ranges is None:
+            return await self.stream_full(file_id, file_info, headers, head=head)
+        if len(ranges) == 1:
+            range_start, range_end = ranges[0]
+            return await self.stream_partial(
+                file_id,
+                range_start,
+                range_end,
+                file_info,
+                client_ip=client_ip,
+                headers=headers,
+                head=head
+            )
+        return self.stream_multipart(file_id, ranges, file_info, headers, head=head)
+        
+    async def stream_full(
+        self,
+        file_id: str,
+        file_info: dict,
+        headers: Optional[dict] = None,
+        head: bool = False
+    ) -> Response:
         """Stream full file"""
         try:
-            client = await self.telegram_manager.get_client()
+            file_size = file_info.get("file_size", 0)
+            content_type = file_info.get("file_type", "application/octet-stream")
             
             async def generate():
-                try:
-                    async for chunk in client.stream_media(file_id, limit=self.chunk_size):
+                if file_size:
+                    last_chunk = (file_size - 1) // self.chunk_size
+                    async for _, chunk in self.fetcher.iter_chunks(
+                        file_id,
+                        file_info,
+                        0,
+                        last_chunk,
+                        # A whole file bigger than the cache would only evict everything else
+                        cache=file_size <= self.cache.max_bytes
+                    ):
                         yield chunk
-                except FloodWait as e:
-                    await asyncio.sleep(e.value)
-                    async for chunk in client.stream_media(file_id, limit=self.chunk_size):
-                        yield chunk
-                finally:
-                    await self.telegram_manager.release_client(client)
+                    return
+                
+                # Unknown size: read sequentially until the last chunk
+                async for _, chunk in self._iter_chunks(file_id, file_info):
+                    yield chunk
             
             headers = {
-                "Content-Type": file_info.get("file_type", "application/octet-stream"),
-                "Content-Length": str(file_info.get("file_size", 0)),
-                "Accept-Ranges": "bytes"
+                **(headers or {"Accept-Ranges": "bytes"}),
+                "Content-Type": content_type
             }
+            if file_size:
+                headers["Content-Length"] = str(file_size)
             
+            if head:
+                return Response(status_code=200, headers=headers)
             return StreamingResponse(
                 generate(),
                 status_code=200,
                 headers=headers,
-                media_type=file_info.get("file_type", "application/octet-stream")
+                media_type=content_type
             )
             
         except Exception as e:
@@ -55,108 +165,155 @@ class ByteStreamer:
         file_id: str, 
         range_start: int, 
         range_end: int, 
-        file_info: dict
-    ) -> StreamingResponse:
+        file_info: dict,
+        client_ip: Optional[str] = None,
+        headers: Optional[dict] = None,
+        head: bool = False
+    ) -> Response:
         """Stream partial file content (range request)"""
         try:
-            client = await self.telegram_manager.get_client()
             file_size = file_info.get("file_size", 0)
+            content_type = file_info.get("file_type", "application/octet-stream")
             
             # Validate range
             if range_start >= file_size:
-                raise HTTPException(status_code=416, detail="Range not satisfiable")
+                raise HTTPException(
+                    status_code=416,
+                    detail="Range not satisfiable",
+                    headers={"Content-Range": f"bytes */{file_size}"}
+                )
             
             range_end = min(range_end, file_size - 1)
             content_length = range_end - range_start + 1
             
-            async def generate():
-                try:
-                    current_pos = 0
-                    async for chunk in client.stream_media(file_id, limit=self.chunk_size):
-                        chunk_start = current_pos
-                        chunk_end = current_pos + len(chunk) - 1
-                        
-                        # Skip chunks before range
-                        if chunk_end < range_start:
-                            current_pos += len(chunk)
-                            continue
-                            
-                        # Stop if we've passed the range
-                        if chunk_start > range_end:
-                            break
-                            
-                        # Trim chunk to fit range
-                        start_offset = max(0, range_start - chunk_start)
-                        end_offset = min(len(chunk), range_end - chunk_start + 1)
-                        
-                        yield chunk[start_offset:end_offset]
-                        current_pos += len(chunk)
-                        
-                except FloodWait as e:
-                    await asyncio.sleep(e.value)
-                finally:
-                    await self.telegram_manager.release_client(client)
-            
             headers = {
-                "Content-Type": file_info.get("file_type", "application/octet-stream"),
+                **(headers or {"Accept-Ranges": "bytes"}),
+                "Content-Type": content_type,
                 "Content-Length": str(content_length),
-                "Content-Range": f"bytes {range_start}-{range_end}/{file_size}",
-                "Accept-Ranges": "bytes"
+                "Content-Range": f"bytes {range_start}-{range_end}/{file_size}"
             }
+            if head:
+                return Response(status_code=206, headers=headers)
+            
+            # Players chain Range requests; remember each (IP, file) so the next
+            # request finds its first chunks already fetched.
+            stream = None
+            if client_ip and self.readahead.enabled:
+                stream = self.readahead.open(client_ip, file_id, file_info, range_start)
             
             return StreamingResponse(
-                generate(),
+                self._iter_range(
+                    file_id,
+                    file_info,
+                    range_start,
+                    range_end,
+                    fetch=stream.fetch if stream else None,
+                    on_chunk=stream.advance if stream else None
+                ),
                 status_code=206,
                 headers=headers,
-                media_type=file_info.get("file_type", "application/octet-stream")
+                media_type=content_type
             )
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Partial streaming error: {e}")
             raise HTTPException(status_code=500, detail=str(e))
             
-    async def stream_download(self, file_id: str, file_info: dict) -> StreamingResponse:
-        """Stream file as download attachment"""
-        response = await self.stream_full(file_id, file_info)
-        response.headers["Content-Disposition"] = f'attachment; filename="{file_info.get("file_name", "download")}"'
-        return response
+    def stream_multipart(
+        self,
+        file_id: str,
+        ranges: List[Tuple[int, int]],
+        file_info: dict,
+        headers: dict,
+        head: bool = False
+    ) -> Response:
+        """Serve several byte ranges as one multipart/byteranges body"""
+        file_size = file_info.get("file_size", 0)
+        content_type = file_info.get("file_type", "application/octet-stream")
+        boundary = uuid.uuid4().hex
+        part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+            ).encode()
+            for start, end in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode()
+        content_length = len(closing) + sum(
+            len(part) + (end - start + 1) + 2
+            for part, (start, end) in zip(part_headers, ranges)
+        )
         
-    def parse_range_header(self, range_header: str, file_size: int) -> Tuple[int, int]:
-        """Parse HTTP Range header"""
-        try:
-            # Range header format: "bytes=start-end"
-            range_part = range_header.replace("bytes=", "")
-            
-            if "-" not in range_part:
-                raise ValueError("Invalid range format")
-                
-            start_str, end_str = range_part.split("-", 1)
-            
-            # Handle different range formats
-            if start_str and end_str:
-                # bytes=0-1023
-                start = int(start_str)
-                end = int(end_str)
-            elif start_str and not end_str:
-                # bytes=1024-
-                start = int(start_str)
-                end = file_size - 1
-            elif not start_str and end_str:
-                # bytes=-1024 (last 1024 bytes)
-                end = file_size - 1
-                start = max(0, file_size - int(end_str))
+        headers = {
+            **headers,
+            "Content-Type": f"multipart/byteranges; boundary={boundary}",
+            "Content-Length": str(content_length)
+        }
+        if head:
+            return Response(status_code=206, headers=headers)
+        
+        async def generate():
+            for part, (start, end) in zip(part_headers, ranges):
+                yield part
+                async for data in self._iter_range(file_id, file_info, start, end):
+                    yield data
+                yield b"\r\n"
+            yield closing
+        
+        return StreamingResponse(generate(), status_code=206, headers=headers)
+        
+    async def _iter_range(
+        self,
+        file_id: str,
+        file_info: dict,
+        range_start: int,
+        range_end: int,
+        fetch: Optional[Callable[[int], Awaitable[bytes]]] = None,
+        on_chunk: Optional[Callable[[int], None]] = None
+    ):
+        """Yield bytes range_start..range_end (inclusive). Telegram serves media
+        in fixed 1MB parts, so only the parts overlapping the range are fetched."""
+        first_chunk = range_start // self.chunk_size
+        last_chunk = range_end // self.chunk_size
+        first_cut = range_start - first_chunk * self.chunk_size
+        last_cut = range_end - last_chunk * self.chunk_size + 1
+        
+        async for index, chunk in self.fetcher.iter_chunks(
+            file_id,
+            file_info,
+            first_chunk,
+            last_chunk,
+            fetch=fetch
+        ):
+            if index == first_chunk and index == last_chunk:
+                yield chunk[first_cut:last_cut]
+            elif index == first_chunk:
+                yield chunk[first_cut:]
+            elif index == last_chunk:
+                yield chunk[:last_cut]
             else:
-                raise ValueError("Invalid range format")
-                
-            # Validate range
-            start = max(0, start)
-            end = min(end, file_size - 1)
+                yield chunk
+            if on_chunk:
+                on_chunk(index)
             
-            if start > end:
-                raise ValueError("Invalid range: start > end")
-                
-            return start, end
-            
-        except Exception as e:
-            logger.error(f"Range parsing error: {e}")
-            return 0, file_size - 1
+    async def _iter_chunks(self, file_id: str, file_info: dict):
+        """Yield (index, chunk) of a file whose size isn't known, one chunk at
+        a time until Telegram returns a short one. Each chunk goes through the
+        fetcher, so a FloodWait moves the stream to another client."""
+        index = 0
+        while True:
+            # Not cached: a file of unknown size may be bigger than the cache
+            chunk = await self.fetcher.fetch_chunk(file_id, file_info, index, cache=False)
+            if chunk:
+                yield index, chunk
+            if len(chunk) < self.chunk_size:
+                return
+            index += 1
+
+def content_disposition(filename: str) -> str:
+    """Attachment header with an ASCII fallback name and the UTF-8 name (RFC 6266)"""
+    fallback = filename.encode("ascii", "replace").decode().replace("?", "_").replace('"', "_").replace("\\", "_")
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(filename, safe="")}'
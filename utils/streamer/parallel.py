@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import AsyncGenerator, Awaitable, Callable, Optional, Tuple
+from pyrogram import Client, raw
+from pyrogram.errors import FloodWait
+from pyrogram.file_id import FileId, FileType
+
+from ..clients import TelegramManager
+from .chunk_cache import ChunkCache
+
+logger = logging.getLogger(__name__)
+
+class ParallelChunkFetcher:
+    """Fetch file chunks concurrently across the pooled Telegram clients"""
+
+    MEDIA_KINDS = ("document", "video", "audio", "photo", "animation", "voice", "video_note")
+    MAX_RETRIES = 3
+    MAX_PENDING_CACHE_WRITES = 32  # Chunks waiting to be written to the disk cache
+
+    def __init__(
+        self,
+        telegram_manager: TelegramManager,
+        chunk_size: int,
+        concurrency: int,
+        window: int,
+        cache: Optional[ChunkCache] = None
+    ):
+        self.telegram_manager = telegram_manager
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.concurrency = max(1, concurrency)
+        self.window = max(self.concurrency, window)
+        # (client name, message id) -> FileId as seen by that client
+        self._file_ids: "OrderedDict[Tuple[str, int], FileId]" = OrderedDict()
+        self._file_ids_max = 1024
+        self._cache_writes: set = set()
+
+    async def iter_chunks(
+        self,
+        file_id: str,
+        file_info: dict,
+        first_chunk: int,
+        last_chunk: int,
+        fetch: Optional[Callable[[int], Awaitable[bytes]]] = None,
+        cache: bool = True
+    ) -> AsyncGenerator[Tuple[int, bytes], None]:
+        """Yield (index, chunk) in order, keeping up to `window` chunks in flight.
+        `fetch` overrides how a single chunk is obtained (e.g. from read-ahead).
+        With `cache=False` chunks fetched from Telegram are not written to the
+        disk cache."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        fetch = fetch or (lambda index: self.fetch_chunk(file_id, file_info, index, cache=cache))
+        pending = deque()
+        next_index = first_chunk
+
+        try:
+            while next_index <= last_chunk or pending:
+                while next_index <= last_chunk and len(pending) < self.window:
+                    pending.append((
+                        next_index,
+                        asyncio.create_task(self._fetch_limited(semaphore, fetch, next_index))
+                    ))
+                    next_index += 1
+
+                index, task = pending.popleft()
+                yield index, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def _fetch_limited(
+        self,
+        semaphore: asyncio.Semaphore,
+        fetch: Callable[[int], Awaitable[bytes]],
+        index: int
+    ) -> bytes:
+        async with semaphore:
+            return await fetch(index)
+
+    async def fetch_chunk(self, file_id: str, file_info: dict, index: int, cache: bool = True) -> bytes:
+        """Fetch a single chunk from the cache or Telegram"""
+        if self.cache:
+            data = await self.cache.get(file_id, index)
+            if data is not None:
+                return data
+
+        data = await self._fetch_remote(file_id, file_info, index)
+
+        if self.cache and cache:
+            self._cache_later(file_id, index, data)
+        return data
+
+    def _cache_later(self, file_id: str, index: int, data: bytes):
+        """Write a chunk to the disk cache in the background, so the reader
+        doesn't wait for the fsync. Chunks are dropped while the disk lags."""
+        if not self.cache.enabled or len(self._cache_writes) >= self.MAX_PENDING_CACHE_WRITES:
+            return
+        task = asyncio.create_task(self._cache_put(file_id, index, data))
+        self._cache_writes.add(task)
+        task.add_done_callback(self._cache_writes.discard)
+
+    async def _cache_put(self, file_id: str, index: int, data: bytes):
+        try:
+            await self.cache.put(file_id, index, data)
+        except Exception as e:
+            logger.warning(f"Caching chunk {index} of {file_id} failed: {e}")
+
+    async def _fetch_remote(self, file_id: str, file_info: dict, index: int) -> bytes:
+        """Fetch a chunk from Telegram, retrying on another client if one fails"""
+        last_error: Optional[Exception] = None
+
+        # Prefer a client that already has a media session on the file's DC
+        dc_id = self.telegram_manager.file_dc(file_id)
+
+        for attempt in range(self.MAX_RETRIES):
+            async with self.telegram_manager.use_client(prefer_user=False, dc_id=dc_id) as client:
+                try:
+                    return await self._get_chunk(client, file_id, file_info, index)
+                except FloodWait as e:
+                    # Move on to another client rather than sleeping; the pool
+                    # keeps this one out of rotation until the wait is over
+                    logger.warning(f"FloodWait of {e.value}s on {client.name} for chunk {index}")
+                    self.telegram_manager.report_flood_wait(client, e.value)
+                    last_error = e
+                except Exception as e:
+                    logger.warning(f"Chunk {index} fetch failed on {client.name} (attempt {attempt + 1}): {e}")
+                    last_error = e
+                    self._file_ids.pop((client.name, file_info.get("telegram_message_id")), None)
+
+        raise last_error
+
+    async def _get_chunk(self, client: Client, file_id: str, file_info: dict, index: int) -> bytes:
+        file_id_obj = await self._resolve_file_id(client, file_id, file_info)
+        session = await self.telegram_manager.get_media_session(client, file_id_obj.dc_id)
+
+        result = await session.invoke(
+            raw.functions.upload.GetFile(
+                location=self._get_location(file_id_obj),
+                offset=index * self.chunk_size,
+                limit=self.chunk_size
+            ),
+            sleep_threshold=0
+        )
+        return result.bytes
+
+    async def _resolve_file_id(self, client: Client, file_id: str, file_info: dict) -> FileId:
+        """File ids are tied to the client that received them, so look the
+        stored message up once per client and cache its own file id."""
+        message_id = file_info.get("telegram_message_id")
+        if not message_id:
+            return FileId.decode(file_id)
+
+        key = (client.name, message_id)
+        cached = self._file_ids.get(key)
+        if cached is not None:
+            self._file_ids.move_to_end(key)
+            return cached
+
+        try:
+            message = await client.get_messages(
+                int(file_info.get("channel_id") or self.telegram_manager.settings.STORAGE_CHANNEL),
+                message_id
+            )
+            media = next(
+                (getattr(message, kind) for kind in self.MEDIA_KINDS if getattr(message, kind, None)),
+                None
+            )
+            file_id_obj = FileId.decode(media.file_id if media else file_id)
+        except Exception as e:
+            logger.warning(f"Could not resolve message {message_id} on {client.name}: {e}")
+            file_id_obj = FileId.decode(file_id)
+
+        self._file_ids[key] = file_id_obj
+        if len(self._file_ids) > self._file_ids_max:
+            self._file_ids.popitem(last=False)
+        return file_id_obj
+
+    def _get_location(self, file_id: FileId):
+        if file_id.file_type == FileType.PHOTO:
+            return raw.types.InputPhotoFileLocation(
+                id=file_id.media_id,
+                access_hash=file_id.access_hash,
+                file_reference=file_id.file_reference,
+                thumb_size=file_id.thumbnail_size
+            )
+        return raw.types.InputDocumentFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size
+        )
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .parallel import ParallelChunkFetcher
+
+logger = logging.getLogger(__name__)
+
+class ReadAheadStream:
+    """Per (client IP, file) playback state with chunks fetched ahead of the reader"""
+
+    def __init__(self, scheduler: "ReadAheadScheduler", file_id: str, file_info: dict):
+        self.scheduler = scheduler
+        self.file_id = file_id
+        self.file_info = file_info
+        self.position = 0  # next byte the player is expected to ask for
+        self.sequential = False
+        self.last_access = time.monotonic()
+        self.chunks: Dict[int, asyncio.Task] = {}
+        self.semaphore = asyncio.Semaphore(scheduler.fetcher.concurrency)
+
+        file_size = file_info.get("file_size", 0)
+        self.last_chunk = (file_size - 1) // scheduler.chunk_size if file_size else -1
+
+    async def fetch(self, index: int) -> bytes:
+        """Return chunk `index`, reusing a prefetched or in-flight fetch if there is one"""
+        task = self.chunks.get(index)
+        if task is None:
+            task = self._spawn(index)
+
+        # Shield so a player dropping the connection doesn't discard the
+        # chunk; the next range request in the chain picks it up instead.
+        try:
+            data = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                # Dropped by a seek from another connection, fetch it directly
+                return await self.scheduler.fetcher.fetch_chunk(self.file_id, self.file_info, index)
+            raise
+        except Exception:
+            self.chunks.pop(index, None)
+            raise
+        # Kept until advance() moves past it so it isn't prefetched again
+        return data
+
+    def advance(self, index: int):
+        """Record that chunk `index` was sent and top up the read-ahead window"""
+        self.last_access = time.monotonic()
+        self.position = (index + 1) * self.scheduler.chunk_size
+
+        for stale in [i for i, t in self.chunks.items() if i <= index and t.done()]:
+            del self.chunks[stale]
+
+        if not self.sequential:
+            return
+
+        for ahead in range(index + 1, min(index + self.scheduler.depth, self.last_chunk) + 1):
+            if ahead in self.chunks:
+                continue
+            if self._buffered_bytes() + self.scheduler.chunk_size > self.scheduler.budget:
+                break
+            self._spawn(ahead)
+
+    def seek(self, range_start: int):
+        """Update state for a new request and decide whether it continues the last one"""
+        chunk_size = self.scheduler.chunk_size
+        self.sequential = self.position - chunk_size <= range_start <= self.position + self.scheduler.depth * chunk_size
+        self.last_access = time.monotonic()
+
+        if not self.sequential:
+            self.close()
+        self.position = range_start
+
+    def close(self):
+        for task in self.chunks.values():
+            task.cancel()
+        self.chunks.clear()
+
+    def _spawn(self, index: int) -> asyncio.Task:
+        task = asyncio.create_task(self._fetch_limited(index))
+        # Prefetches nobody ends up reading must not log "exception never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.chunks[index] = task
+        return task
+
+    async def _fetch_limited(self, index: int) -> bytes:
+        async with self.semaphore:
+            return await self.scheduler.fetcher.fetch_chunk(self.file_id, self.file_info, index)
+
+    def _buffered_bytes(self) -> int:
+        return len(self.chunks) * self.scheduler.chunk_size
+
+class ReadAheadScheduler:
+    """Detect sequential range requests and prefetch the next chunks in the background"""
+
+    def __init__(
+        self,
+        fetcher: ParallelChunkFetcher,
+        chunk_size: int,
+        depth: int,
+        budget: int,
+        idle_ttl: int,
+        max_streams: int
+    ):
+        self.fetcher = fetcher
+        self.chunk_size = chunk_size
+        self.depth = depth
+        self.budget = budget
+        self.idle_ttl = idle_ttl
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[Tuple[str, str], ReadAheadStream]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        self.enabled = depth > 0 and budget >= chunk_size
+
+    def start(self):
+        """Drop idle streams periodically, so their prefetched chunks are
+        freed even when no new range request comes in"""
+        if self.enabled and self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        for stream in self._streams.values():
+            stream.close()
+        self._streams.clear()
+
+    def open(self, client_ip: str, file_id: str, file_info: dict, range_start: int) -> ReadAheadStream:
+        """Get the stream for this (client IP, file), creating it on first access"""
+        self._expire()
+
+        key = (client_ip, file_id)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = ReadAheadStream(self, file_id, file_info)
+            stream.position = range_start
+            self._streams[key] = stream
+        else:
+            stream.seek(range_start)
+            self._streams.move_to_end(key)
+
+        while len(self._streams) > self.max_streams:
+            _, evicted = self._streams.popitem(last=False)
+            evicted.close()
+
+        return stream
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._streams),
+            "buffered_chunks": sum(len(s.chunks) for s in self._streams.values())
+        }
+
+    async def _sweep(self):
+        interval = max(1, self.idle_ttl / 2)
+        while True:
+            await asyncio.sleep(interval)
+            self._expire()
+
+    def _expire(self):
+        deadline = time.monotonic() - self.idle_ttl
+        for key in [k for k, s in self._streams.items() if s.last_access < deadline]:
+            self._streams.pop(key).close()
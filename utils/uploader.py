@@ -1,25 +1,53 @@
 
-import asyncio
 import os
-import time
+import uuid
 import logging
-from typing import Dict, Optional, Callable
+from typing import AsyncIterator, Optional, Callable, Tuple
 from pyrogram import Client
+from pyrogram.errors import FloodWait
 from pyrogram.types import Message
-from PIL import Image
-import magic
 
 from .clients import TelegramManager
 from .directoryHandler import DatabaseManager
-from .file_properties import get_video_duration, get_audio_duration
+from .file_properties import MediaProber
+from .ingest import hash_file
+from .part_uploader import ParallelPartUploader, BIG_FILE_SIZE
+from .progress import ProgressTracker
 
 logger = logging.getLogger(__name__)
 
+# Probed properties stored in the catalog's media_info column
+MEDIA_FIELDS = ("duration", "width", "height", "bitrate", "container", "video_codec", "audio_codec")
+
 class TelegramUploader:
-    def __init__(self, telegram_manager: TelegramManager, db_manager: DatabaseManager):
+    FLOOD_RETRIES = 3  # Clients to try when uploads hit FloodWait
+    
+    def __init__(
+        self,
+        telegram_manager: TelegramManager,
+        db_manager: DatabaseManager,
+        progress: Optional[ProgressTracker] = None
+    ):
         self.telegram_manager = telegram_manager
         self.db_manager = db_manager
-        self.progress_data: Dict[str, dict] = {}
+        self.progress = progress or ProgressTracker()
+        settings = telegram_manager.settings
+        self.part_uploader = ParallelPartUploader(
+            workers=settings.UPLOAD_PART_WORKERS,
+            connections=settings.UPLOAD_CONNECTIONS,
+            retries=settings.UPLOAD_PART_RETRIES
+        )
+        self.parallel_min_size = max(settings.UPLOAD_PARALLEL_MIN_SIZE, BIG_FILE_SIZE + 1)
+        self.prober = MediaProber(
+            settings.METADATA_WORKERS,
+            settings.METADATA_TIMEOUT,
+            thumbnail_size=settings.THUMBNAIL_SIZE,
+            thumbnail_quality=settings.THUMBNAIL_QUALITY
+        )
+        
+    def close(self):
+        """Stop the metadata worker processes"""
+        self.prober.close()
         
     async def upload_file(
         self, 
@@ -27,109 +55,246 @@ class TelegramUploader:
         filename: str, 
         user_id: str,
         file_size: int,
-        progress_callback: Optional[Callable] = None
+        progress_callback: Optional[Callable] = None,
+        mime_type: Optional[str] = None,
+        delete_on_error: bool = True,
+        task_id: Optional[str] = None,
+        sha256: Optional[str] = None
     ) -> dict:
-        """Upload file to Telegram and save to database"""
-        task_id = f"{user_id}_{int(time.time())}"
+        """Upload file to Telegram and save to database.
+        Pass delete_on_error=False to keep the file for a retry. When a
+        `task_id` is given, progress is reported under it and the caller
+        (e.g. the job queue) decides when the task has failed for good.
+        
+        Files whose content is already stored are not uploaded again; the
+        new catalog row points at the existing message. Pass `sha256` if
+        it was computed while receiving the file."""
+        owns_task = task_id is None
+        task_id = task_id or uuid.uuid4().hex
         
         try:
-            self.progress_data[task_id] = {
-                "status": "starting",
-                "progress": 0,
-                "filename": filename,
-                "file_size": file_size
-            }
+            self.progress.set_status(
+                task_id,
+                "starting",
+                filename=filename,
+                file_size=file_size
+            )
             
-            client = await self.telegram_manager.get_client(prefer_user=True)
+            sha256 = sha256 or await hash_file(file_path)
+            existing = await self.db_manager.get_file_by_hash(sha256, file_size)
+            if existing:
+                return await self._link_existing(existing, file_path, filename, user_id, file_size, sha256, task_id)
             
-            # Determine file type and prepare metadata
-            mime_type = magic.from_file(file_path, mime=True)
+            # Determine file type (unless sniffed during ingestion) and prepare metadata
             file_info = await self._prepare_file_metadata(file_path, filename, mime_type)
             
-            self.progress_data[task_id]["status"] = "uploading"
+            # Upload based on file type, holding a client slot only while sending
+            for attempt in range(self.FLOOD_RETRIES):
+                async with self.telegram_manager.use_client(prefer_user=True) as client:
+                    self.progress.set_status(task_id, "uploading")
+                    try:
+                        message = await self._upload_by_type(
+                            client, 
+                            file_path, 
+                            file_info,
+                            lambda current, total: self._update_progress(task_id, current, total)
+                        )
+                        break
+                    except FloodWait as e:
+                        # Retry on another client while this one cools down
+                        logger.warning(f"FloodWait of {e.value}s on {client.name} uploading {filename}")
+                        self.telegram_manager.report_flood_wait(client, e.value)
+                        if attempt == self.FLOOD_RETRIES - 1:
+                            raise
             
-            # Upload based on file type
-            message = await self._upload_by_type(
-                client, 
-                file_path, 
-                file_info,
-                lambda current, total: self._update_progress(task_id, current, total)
+            return await self._record_upload(
+                message, file_path, file_info, user_id, file_size, sha256, task_id
             )
             
-            # Save to database
-            file_record = {
-                "user_id": user_id,
-                "file_name": filename,
-                "file_size": file_size,
-                "file_type": mime_type,
-                "telegram_file_id": self._get_file_id(message),
-                "telegram_message_id": message.id,
-                "channel_id": str(self.telegram_manager.settings.STORAGE_CHANNEL)
-            }
-            
-            await self.db_manager.save_file(file_record)
-            
-            self.progress_data[task_id] = {
-                "status": "completed",
-                "progress": 100,
-                "filename": filename,
-                "message_id": message.id
-            }
-            
-            # Cleanup
-            if os.path.exists(file_path):
-                os.unlink(file_path)
-                
-            await self.telegram_manager.release_client(client)
-            
-            return {
-                "success": True,
-                "message_id": message.id,
-                "file_id": self._get_file_id(message)
-            }
-            
         except Exception as e:
             logger.error(f"Upload error: {e}")
-            self.progress_data[task_id] = {
-                "status": "failed",
-                "progress": 0,
-                "error": str(e)
-            }
+            if owns_task:
+                self.progress.set_status(task_id, "failed", error=str(e))
             
-            if os.path.exists(file_path):
+            if delete_on_error and os.path.exists(file_path):
                 os.unlink(file_path)
                 
             raise e
             
-    async def _prepare_file_metadata(self, file_path: str, filename: str, mime_type: str) -> dict:
-        """Prepare file metadata for upload"""
-        file_info = {
-            "filename": filename,
-            "mime_type": mime_type,
-            "supports_streaming": False
-        }
+    async def upload_from_parts(
+        self,
+        parts: AsyncIterator[Tuple[int, bytes]],
+        file_path: str,
+        filename: str,
+        user_id: str,
+        file_size: int,
+        task_id: Optional[str] = None
+    ) -> dict:
+        """Upload a file that is still being written to `file_path`.
+        
+        `parts` yields (part index, bytes) as each 512KB part lands on
+        disk, so the upload runs alongside the download. Once the last part
+        is sent the file is complete and its metadata is read from disk.
+        The bytes are already sent by then, but a duplicate of a stored
+        file still reuses the existing message instead of creating one.
+        """
+        owns_task = task_id is None
+        task_id = task_id or uuid.uuid4().hex
         
-        if mime_type.startswith("image/"):
-            try:
-                with Image.open(file_path) as img:
-                    file_info["width"] = img.width
-                    file_info["height"] = img.height
-            except Exception:
-                pass
+        try:
+            async with self.telegram_manager.use_client(prefer_user=True) as client:
+                self.progress.set_status(task_id, "transferring", filename=filename, file_size=file_size)
+                input_file = await self.part_uploader.upload_parts(
+                    client,
+                    parts,
+                    file_size,
+                    filename,
+                    lambda current, total: self._update_progress(task_id, current, total)
+                )
+                
+                sha256 = await hash_file(file_path)
+                existing = await self.db_manager.get_file_by_hash(sha256, file_size)
+                if existing:
+                    return await self._link_existing(
+                        existing, file_path, filename, user_id, file_size, sha256, task_id
+                    )
+                
+                file_info = await self._prepare_file_metadata(file_path, filename)
+                message = await self.part_uploader.finalize(
+                    client,
+                    self.telegram_manager.settings.STORAGE_CHANNEL,
+                    input_file,
+                    file_info,
+                    path=file_path
+                )
                 
-        elif mime_type.startswith("video/"):
-            file_info["supports_streaming"] = True
-            file_info["duration"] = await get_video_duration(file_path)
+            return await self._record_upload(
+                message, file_path, file_info, user_id, file_size, sha256, task_id
+            )
             
-        elif mime_type.startswith("audio/"):
-            file_info["duration"] = await get_audio_duration(file_path)
+        except Exception as e:
+            logger.error(f"Pipelined upload error: {e}")
+            if owns_task:
+                self.progress.set_status(task_id, "failed", error=str(e))
+            raise
             
+    async def _record_upload(
+        self,
+        message: Message,
+        file_path: str,
+        file_info: dict,
+        user_id: str,
+        file_size: int,
+        sha256: str,
+        task_id: str
+    ) -> dict:
+        """Save the catalog row (and thumbnail) for an uploaded message and
+        remove the local copy"""
+        media_info = {field: file_info[field] for field in MEDIA_FIELDS if file_info.get(field) is not None}
+        telegram_file_id = self._get_file_id(message)
+        thumbnail = file_info.get("thumbnail")
+        if thumbnail and await self.db_manager.save_thumbnail(telegram_file_id, thumbnail):
+            media_info["thumbnail"] = True
+            
+        return await self._save_record(
+            {
+                "user_id": user_id,
+                "file_name": file_info["filename"],
+                "file_size": file_size,
+                "file_type": file_info["mime_type"],
+                "telegram_file_id": telegram_file_id,
+                "telegram_message_id": message.id,
+                "channel_id": str(self.telegram_manager.settings.STORAGE_CHANNEL),
+                "sha256": sha256,
+                "media_info": media_info or None
+            },
+            file_path,
+            task_id
+        )
+        
+    async def _link_existing(
+        self,
+        existing: dict,
+        file_path: str,
+        filename: str,
+        user_id: str,
+        file_size: int,
+        sha256: str,
+        task_id: str
+    ) -> dict:
+        """Catalog a duplicate upload under the message already holding its bytes"""
+        logger.info(f"{filename} duplicates stored file {existing.get('id')}, skipping upload")
+        return await self._save_record(
+            {
+                "user_id": user_id,
+                "file_name": filename,
+                "file_size": file_size,
+                "file_type": existing.get("file_type"),
+                "telegram_file_id": existing["telegram_file_id"],
+                "telegram_message_id": existing["telegram_message_id"],
+                "channel_id": existing["channel_id"],
+                "sha256": sha256,
+                "media_info": existing.get("media_info")
+            },
+            file_path,
+            task_id,
+            deduplicated=True
+        )
+        
+    async def _save_record(
+        self,
+        file_record: dict,
+        file_path: str,
+        task_id: str,
+        deduplicated: bool = False
+    ) -> dict:
+        await self.db_manager.save_file(file_record)
+        
+        message_id = file_record["telegram_message_id"]
+        self.progress.set_status(task_id, "completed", message_id=message_id, deduplicated=deduplicated)
+        
+        # Cleanup
+        if os.path.exists(file_path):
+            os.unlink(file_path)
+            
+        return {
+            "success": True,
+            "task_id": task_id,
+            "message_id": message_id,
+            "file_id": file_record["telegram_file_id"],
+            "deduplicated": deduplicated
+        }
+        
+    async def _prepare_file_metadata(
+        self,
+        file_path: str,
+        filename: str,
+        mime_type: Optional[str] = None
+    ) -> dict:
+        """Prepare file metadata for upload. MIME sniffing (unless `mime_type`
+        is known), image decoding and ffprobe run in the metadata workers."""
+        file_info = await self.prober.probe(file_path, mime_type)
+        file_info["filename"] = filename
+        file_info["supports_streaming"] = file_info["mime_type"].startswith("video/")
         return file_info
         
     async def _upload_by_type(self, client: Client, file_path: str, file_info: dict, progress_callback) -> Message:
         """Upload file based on its type"""
         channel_id = self.telegram_manager.settings.STORAGE_CHANNEL
         
+        if (
+            not file_info["mime_type"].startswith("image/")
+            and os.path.getsize(file_path) >= self.parallel_min_size
+        ):
+            # Big files: send 512KB parts concurrently over several connections
+            return await self.part_uploader.send_media(
+                client,
+                channel_id,
+                file_path,
+                file_info,
+                progress_callback
+            )
+        
         if file_info["mime_type"].startswith("image/"):
             return await client.send_photo(
                 channel_id,
@@ -143,7 +308,9 @@ class TelegramUploader:
                 channel_id,
                 file_path,
                 caption=file_info["filename"],
-                duration=file_info.get("duration", 0),
+                duration=file_info.get("duration") or 0,
+                width=file_info.get("width") or 0,
+                height=file_info.get("height") or 0,
                 supports_streaming=file_info.get("supports_streaming", False),
                 progress=progress_callback
             )
@@ -153,7 +320,7 @@ class TelegramUploader:
                 channel_id,
                 file_path,
                 caption=file_info["filename"],
-                duration=file_info.get("duration", 0),
+                duration=file_info.get("duration") or 0,
                 progress=progress_callback
             )
             
@@ -179,10 +346,8 @@ class TelegramUploader:
         
     def _update_progress(self, task_id: str, current: int, total: int):
         """Update upload progress"""
-        if task_id in self.progress_data:
-            progress = (current / total) * 100 if total > 0 else 0
-            self.progress_data[task_id]["progress"] = progress
+        self.progress.update(task_id, current, total)
             
     async def get_progress(self, task_id: str) -> dict:
         """Get upload progress"""
-        return self.progress_data.get(task_id, {"status": "not_found", "progress": 0})
+        return self.progress.get(task_id) or {"status": "not_found", "progress": 0}